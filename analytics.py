@@ -0,0 +1,230 @@
+from datetime import date, datetime, timedelta, timezone
+
+from history import HistoryQueryError, ist_day_start, parse_day
+from models import db, Faculty, MonthClose, MonthlySummary, ScanRecord
+from receipts import IST
+from rollup import as_date
+
+# IST is UTC+05:30 all year, so IST days and months of the stored (naive UTC)
+# timestamps are computed in SQL by shifting them
+IST_OFFSET = timedelta(hours=5, minutes=30)
+
+# Longest range /api/analytics/daily aggregates live in one request
+MAX_DAILY_RANGE = timedelta(days=366)
+
+REPORT_COLUMNS = {
+    'faculty': ('month', 'device', 'faculty_id', 'name', 'phone_number', 'department', 'meals', 'meal_days'),
+    'department': ('month', 'department', 'meals', 'faculty'),
+    'month': ('month', 'meals', 'faculty'),
+}
+
+
+def ist_day(column):
+    """SQL expression for the IST calendar day of a UTC timestamp column."""
+    if db.engine.dialect.name == 'sqlite':
+        return db.func.date(column, '+330 minutes')
+    return db.cast(column + IST_OFFSET, db.Date)
+
+
+def ist_month(column):
+    """SQL expression for the first day of the IST month of a UTC timestamp column."""
+    if db.engine.dialect.name == 'sqlite':
+        return db.func.strftime('%Y-%m-01', column, '+330 minutes')
+    return db.cast(db.func.date_trunc('month', column + IST_OFFSET), db.Date)
+
+
+def current_month(now=None):
+    """First day of the IST month containing ``now`` (a naive UTC datetime)."""
+    ist = (now or datetime.utcnow()).replace(tzinfo=timezone.utc).astimezone(IST)
+    return date(ist.year, ist.month, 1)
+
+
+def current_day(now=None):
+    """IST calendar day containing ``now`` (a naive UTC datetime)."""
+    return (now or datetime.utcnow()).replace(tzinfo=timezone.utc).astimezone(IST).date()
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def parse_month(value):
+    """Parse a ``YYYY-MM`` filter value into the month's first day, or None if empty."""
+    if not value:
+        return None
+    try:
+        year, month = value.split('-')
+        return date(int(year), int(month), 1)
+    except ValueError:
+        raise HistoryQueryError(f'Invalid month {value!r}, expected YYYY-MM')
+
+
+def months_from(args):
+    """``(start, end)`` months from ``from``/``to`` args, defaulting to this month."""
+    start = parse_month(args.get('from'))
+    end = parse_month(args.get('to')) or max(start or current_month(), current_month())
+    start = start or end
+    if start > end:
+        raise HistoryQueryError('from must not be after to')
+    return start, end
+
+
+def days_from(args):
+    """``(start, end)`` IST days from ``from``/``to`` args, defaulting to the last 30 days."""
+    end = parse_day(args.get('to')) or current_day()
+    start = parse_day(args.get('from')) or end - timedelta(days=29)
+    if start > end:
+        raise HistoryQueryError('from must not be after to')
+    if end - start >= MAX_DAILY_RANGE:
+        raise HistoryQueryError('Daily ranges are limited to a year; use the monthly report')
+    return start, end
+
+
+def daily(start, end, devices=None, department=None):
+    """Meals and distinct faculty per IST day and device, ``start`` to ``end`` inclusive."""
+    day = ist_day(ScanRecord.scanned_at)
+    stmt = (
+        db.select(day, ScanRecord.device, db.func.count(), db.func.count(db.distinct(ScanRecord.faculty_id)))
+        .where(ScanRecord.scanned_at >= ist_day_start(start),
+               ScanRecord.scanned_at < ist_day_start(end + timedelta(days=1)))
+        .group_by(day, ScanRecord.device)
+        .order_by(day, ScanRecord.device)
+    )
+    if devices:
+        stmt = stmt.where(ScanRecord.device.in_(devices))
+    if department:
+        stmt = stmt.join(Faculty, ScanRecord.faculty_id == Faculty.id).where(Faculty.department == department)
+    return [{'day': as_date(day).isoformat(), 'device': device, 'meals': meals, 'faculty': faculty}
+            for day, device, meals, faculty in db.session.execute(stmt)]
+
+
+def close_month(month, device):
+    """Rewrite the summary rows of an ended month at ``device``; returns ``(meals, faculty)``."""
+    if month >= current_month():
+        raise HistoryQueryError(f'{month:%Y-%m} has not ended yet')
+    db.session.execute(db.delete(MonthlySummary).where(MonthlySummary.month == month,
+                                                        MonthlySummary.device == device))
+    db.session.execute(db.delete(MonthClose).where(MonthClose.month == month, MonthClose.device == device))
+    per_faculty = (
+        db.select(
+            db.literal(month, db.Date),
+            db.literal(device, db.String),
+            ScanRecord.faculty_id,
+            Faculty.department,
+            db.func.count(),
+            db.func.count(db.distinct(ist_day(ScanRecord.scanned_at))),
+        )
+        .join(Faculty, ScanRecord.faculty_id == Faculty.id)
+        .where(ScanRecord.device == device,
+               ScanRecord.scanned_at >= ist_day_start(month),
+               ScanRecord.scanned_at < ist_day_start(next_month(month)))
+        .group_by(ScanRecord.faculty_id, Faculty.department)
+    )
+    db.session.execute(db.insert(MonthlySummary).from_select(
+        ['month', 'device', 'faculty_id', 'department', 'meals', 'meal_days'], per_faculty))
+    meals, faculty = db.session.execute(
+        db.select(db.func.coalesce(db.func.sum(MonthlySummary.meals), 0), db.func.count())
+        .where(MonthlySummary.month == month, MonthlySummary.device == device)
+    ).one()
+    db.session.add(MonthClose(month=month, device=device, meals=meals, faculty=faculty))
+    db.session.commit()
+    return meals, faculty
+
+
+def close_due_months(devices, now=None):
+    """Close every ended month of ``devices`` not closed yet; returns ``[(month, device, meals)]``."""
+    this_month = current_month(now)
+    closed = set(db.session.execute(db.select(MonthClose.month, MonthClose.device)).all())
+    results = []
+    for device in devices:
+        first_scan = db.session.execute(
+            db.select(db.func.min(ScanRecord.scanned_at)).where(ScanRecord.device == device)
+        ).scalar()
+        if first_scan is None:
+            continue
+        month = current_month(first_scan)
+        while month < this_month:
+            if (month, device) not in closed:
+                meals, _ = close_month(month, device)
+                results.append((month, device, meals))
+            month = next_month(month)
+    return results
+
+
+def _summary_rows(start, end, devices, department):
+    stmt = (
+        db.select(
+            MonthlySummary.month, MonthlySummary.device, MonthlySummary.faculty_id,
+            Faculty.name, Faculty.phone_number, MonthlySummary.department,
+            MonthlySummary.meals, MonthlySummary.meal_days,
+        )
+        .outerjoin(Faculty, MonthlySummary.faculty_id == Faculty.id)
+        .where(MonthlySummary.month >= start, MonthlySummary.month <= end,
+               MonthlySummary.device.in_(devices))
+    )
+    if department:
+        stmt = stmt.where(MonthlySummary.department == department)
+    return db.session.execute(stmt).all()
+
+
+def _live_rows(start, end, devices, department, closed):
+    month = ist_month(ScanRecord.scanned_at)
+    stmt = (
+        db.select(
+            month, ScanRecord.device, ScanRecord.faculty_id,
+            Faculty.name, Faculty.phone_number, Faculty.department,
+            db.func.count(), db.func.count(db.distinct(ist_day(ScanRecord.scanned_at))),
+        )
+        .join(Faculty, ScanRecord.faculty_id == Faculty.id)
+        .where(ScanRecord.device.in_(devices),
+               ScanRecord.scanned_at >= ist_day_start(start),
+               ScanRecord.scanned_at < ist_day_start(next_month(end)))
+        .group_by(month, ScanRecord.device, ScanRecord.faculty_id,
+                  Faculty.name, Faculty.phone_number, Faculty.department)
+    )
+    if department:
+        stmt = stmt.where(Faculty.department == department)
+    rows = []
+    for row in db.session.execute(stmt):
+        row_month = as_date(row[0])
+        if (row_month, row[1]) not in closed:
+            rows.append((row_month,) + tuple(row[1:]))
+    return rows
+
+
+def report(start, end, devices, department=None, group='faculty'):
+    """Billing rows for months ``start`` to ``end``; closed months are read from ``MonthlySummary``."""
+    if group not in REPORT_COLUMNS:
+        raise HistoryQueryError(f"group must be one of {', '.join(REPORT_COLUMNS)}")
+    closed = set(db.session.execute(
+        db.select(MonthClose.month, MonthClose.device)
+        .where(MonthClose.month >= start, MonthClose.month <= end, MonthClose.device.in_(devices))
+    ).all())
+    rows = list(_summary_rows(start, end, devices, department))
+    month = start
+    while month <= end:
+        if any((month, device) not in closed for device in devices):
+            # Everything from the first open month on; closed months in there are skipped
+            rows += _live_rows(month, end, devices, department, closed)
+            break
+        month = next_month(month)
+
+    if group == 'faculty':
+        result = [
+            {'month': f'{row[0]:%Y-%m}', 'device': row[1], 'faculty_id': row[2], 'name': row[3],
+             'phone_number': row[4], 'department': row[5], 'meals': row[6], 'meal_days': row[7]}
+            for row in rows
+        ]
+        result.sort(key=lambda r: (r['month'], r['device'], r['department'], r['name'] or ''))
+        return result
+
+    totals = {}
+    for row in rows:
+        key = (f'{row[0]:%Y-%m}', row[5]) if group == 'department' else (f'{row[0]:%Y-%m}',)
+        entry = totals.setdefault(key, [0, set()])
+        entry[0] += row[6]
+        entry[1].add(row[2])
+    return [
+        dict(zip(REPORT_COLUMNS[group], key + (meals, len(faculty))))
+        for key, (meals, faculty) in sorted(totals.items())
+    ]
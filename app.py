@@ -1,10 +1,35 @@
+import csv
+import functools
+import hmac
+import itertools
+import logging
 import os
 import uuid
-from datetime import datetime, timedelta, timezone
-from zoneinfo import ZoneInfo
-from flask import Flask, render_template, request, jsonify, redirect, url_for, make_response
-from flask_sqlalchemy import SQLAlchemy
-from flask_socketio import SocketIO, emit
+import urllib.parse
+from collections import namedtuple
+from datetime import datetime
+import click
+from flask import Flask, Response, abort, render_template, request, jsonify, redirect, url_for, make_response, send_file, stream_with_context
+from flask_socketio import SocketIO
+from markupsafe import escape
+import analytics
+import assets
+import history
+import logs
+import metrics
+import onboarding
+import qr
+import rollup
+from caches import DataVersions, FacultyCache, RecentScansCache
+from counters import CounterService
+from migrations import upgrade_to_devices
+from realtime import EventBatcher, LocalPubSubManager
+from receipts import ReceiptInvalid, ReceiptSigner, format_ist
+from sessions import DEFAULT_SESSIONS, ServedIndex, SessionSchedule, format_time, parse_sessions
+from startup import Startup
+from ingest import ScanWriter
+from models import db, configure_sqlite, ensure_schema, DailyRollup, Faculty, ScanRecord
+from tts import TTSBusy, TTSCache, TTSExecutor, TTSUnavailable, cache_key as tts_cache_key
 
 
 
@@ -20,17 +45,98 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 APPLICATION_ROOT = os.environ.get('APPLICATION_ROOT', '/auto_canteen')
 app.config['APPLICATION_ROOT'] = APPLICATION_ROOT
 app.config['PREFERRED_URL_SCHEME'] = 'https'
+# Public URL of the app, including APPLICATION_ROOT; encoded in QR codes
+# instead of whatever Host header a request carried. Unset, /qr uses the
+# request host and the CLI commands need --base-url
+BASE_URL = os.environ.get('BASE_URL', '').rstrip('/')
+
+db.init_app(app)
+
+# Schema checks and warm-up run in the background (see create_app); requests wait up to STARTUP_TIMEOUT.
+# Anything that opens files, connections or threads is a setup hook, so importing the app has no side effects
+startup = Startup(app)
+STARTUP_TIMEOUT = float(os.environ.get('STARTUP_TIMEOUT', 30))
+
+log = logging.getLogger('auto_canteen')
+
+@startup.setup
+def configure_logging():
+    # JSON logs to stdout and a rotating auto_canteen.log, written by a background thread
+    logs.setup_logging(
+        level=os.environ.get('LOG_LEVEL', 'INFO'),
+        log_file=os.environ.get('LOG_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'auto_canteen.log')),
+        max_bytes=int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+        backups=int(os.environ.get('LOG_BACKUPS', 5)),
+        sample_every=int(os.environ.get('LOG_SAMPLE_EVERY', 10)),
+    )
+
+# Serving counters run by this server, e.g. CANTEEN_DEVICES=1,2,3
+DEVICES = [d.strip() for d in os.environ.get('CANTEEN_DEVICES', '1,2').split(',') if d.strip()]
+
+# Message queue shared by several worker processes, e.g. redis://localhost:6379/0 (local:// for one process)
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+
+# Meal counters; values are only cached in-process when there is a single worker
+meal_counters = {device: CounterService(device, cache_values=not SOCKETIO_MESSAGE_QUEUE) for device in DEVICES}
+
+# One meal per faculty member per session, e.g. MEAL_SESSIONS=breakfast=07:30-10:30,lunch=12:00-15:00 (IST)
+meal_schedule = SessionSchedule(parse_sessions(os.environ.get('MEAL_SESSIONS', DEFAULT_SESSIONS)))
+# Who has been served this session; only usable with a single worker
+served_index = ServedIndex(enabled=not SOCKETIO_MESSAGE_QUEUE)
+
+# Signed scan receipts let the scan-success page render without the database
+receipt_signer = ReceiptSigner(app.config['SECRET_KEY'], max_age=int(os.environ.get('RECEIPT_MAX_AGE', 3600)))
+# Links handed to bulk-imported faculty; opening one registers that browser
+enrollment_signer = onboarding.EnrollmentSigner(
+    app.config['SECRET_KEY'], max_age=int(os.environ.get('ENROLL_LINK_MAX_AGE', 30 * 24 * 3600)))
+# Required in the X-Admin-Token header by admin APIs; they are disabled while unset
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Faculty identities looked up from the faculty_id cookies on every scan
+faculty_cache = FacultyCache(
+    max_entries=int(os.environ.get('FACULTY_CACHE_SIZE', 2048)),
+    ttl=int(os.environ.get('FACULTY_CACHE_TTL', 300)),
+)
 
-db = SQLAlchemy(app)
-socketio = SocketIO(
-    app, 
-    cors_allowed_origins="*", 
-    async_mode='threading',
-    # Ensure Socket.IO works with Nginx reverse proxy
-    ping_timeout=60,
-    ping_interval=25,
-    engineio_logger=False,
-    socketio_logger=False
+# Bumped on every scan, reset and registration; polling endpoints answer
+# If-None-Match from it without querying the database
+data_versions = DataVersions(enabled=not SOCKETIO_MESSAGE_QUEUE)
+
+# Synthesized speech cache: an in-memory LRU backed by files that survive
+# restarts, with the least recently used files deleted past TTS_CACHE_MAX_BYTES
+TTS_CACHE_DIR = os.environ.get('TTS_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tts_cache'))
+tts_cache = TTSCache(TTS_CACHE_DIR, max_disk_bytes=int(os.environ.get('TTS_CACHE_MAX_BYTES', 64 * 1024 * 1024)))
+
+# Rendered QR codes for /qr/<device>/<kind>, kept in memory and on disk
+QR_CACHE_DIR = os.environ.get('QR_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qr_cache'))
+qr_cache = qr.QRCache(QR_CACHE_DIR, max_entries=int(os.environ.get('QR_CACHE_SIZE', 128)),
+                      max_disk_bytes=int(os.environ.get('QR_CACHE_MAX_BYTES', 16 * 1024 * 1024)))
+
+# Page JS/CSS and the vendored Socket.IO client from assets/, served from
+# /assets/ under content-hashed names with precompressed variants
+static_assets = assets.AssetPipeline(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets'),
+    os.environ.get('ASSET_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'dist')),
+)
+# A small fixed pool of synthesis workers; a full queue answers 503 + Retry-After
+tts_executor = TTSExecutor(
+    tts_cache,
+    workers=int(os.environ.get('TTS_WORKERS', 2)),
+    max_queue=int(os.environ.get('TTS_QUEUE_SIZE', 16)),
+)
+# Stream cache misses straight from the synthesizer's stdout (?stream=0 to disable per request)
+TTS_STREAMING = os.environ.get('TTS_STREAMING', 'true').lower() == 'true'
+
+# Attached to the app by the init_socketio setup hook; a message queue is connected to then
+socketio = SocketIO()
+
+# Scan and counter events reach displays as one sequence-numbered batch per
+# device every EVENT_BATCH_WINDOW_MS (0 sends each event immediately)
+event_batcher = EventBatcher(
+    socketio,
+    room=lambda device: device_room(device),
+    window=int(os.environ.get('EVENT_BATCH_WINDOW_MS', 150)) / 1000,
+    replay_size=int(os.environ.get('EVENT_REPLAY_SIZE', 256)),
 )
 
 # --- WSGI Middleware for subpath handling and reverse proxy support ---
@@ -57,104 +163,246 @@ class ReverseProxied:
         
         return self.app(environ, start_response)
 
-app.wsgi_app = ReverseProxied(app.wsgi_app, APPLICATION_ROOT)
-
-# --- Database Models ---
-class Faculty(db.Model):
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    name = db.Column(db.String(100), nullable=False)
-    phone_number = db.Column(db.String(10), unique=True, nullable=False) 
-    department = db.Column(db.String(100), nullable=False)
-    registration_date = db.Column(db.DateTime, default=datetime.utcnow)
-    scan_records = db.relationship('ScanRecord', backref='faculty', lazy=True)
-
-class ScanRecord(db.Model):
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    faculty_id = db.Column(db.String(36), db.ForeignKey('faculty.id'), nullable=False)
-    scanned_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class MealCounter(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    count = db.Column(db.Integer, default=0)
-    last_reset = db.Column(db.DateTime, default=datetime.utcnow)
-
-# --- Device 2 Database Models (Separate tables for second device) ---
-class Faculty2(db.Model):
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    name = db.Column(db.String(100), nullable=False)
-    phone_number = db.Column(db.String(10), unique=True, nullable=False) 
-    department = db.Column(db.String(100), nullable=False)
-    registration_date = db.Column(db.DateTime, default=datetime.utcnow)
-    scan_records = db.relationship('ScanRecord2', backref='faculty', lazy=True)
-
-class ScanRecord2(db.Model):
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    faculty_id = db.Column(db.String(36), db.ForeignKey('faculty2.id'), nullable=False)
-    scanned_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-class MealCounter2(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    count = db.Column(db.Integer, default=0)
-    last_reset = db.Column(db.DateTime, default=datetime.utcnow)
+@startup.setup
+def init_socketio():
+    socketio_queue_options = {}
+    if SOCKETIO_MESSAGE_QUEUE and SOCKETIO_MESSAGE_QUEUE.startswith('local://'):
+        socketio_queue_options['client_manager'] = LocalPubSubManager(SOCKETIO_MESSAGE_QUEUE)
+    elif SOCKETIO_MESSAGE_QUEUE:
+        socketio_queue_options['message_queue'] = SOCKETIO_MESSAGE_QUEUE
+
+    socketio.init_app(
+        app, 
+        cors_allowed_origins="*", 
+        async_mode=os.environ.get('SOCKETIO_ASYNC_MODE', 'threading'),
+        **socketio_queue_options,
+        # Ensure Socket.IO works with Nginx reverse proxy
+        ping_timeout=60,
+        ping_interval=25,
+        engineio_logger=False,
+        socketio_logger=False
+    )
+    # Outside the Socket.IO middleware, so it also sees the prefix-stripped path and scheme
+    app.wsgi_app = ReverseProxied(app.wsgi_app, APPLICATION_ROOT)
 
 # --- Helper functions ---
-def get_meal_counter():
-    counter = MealCounter.query.first()
-    if not counter:
-        counter = MealCounter(count=0)
-        db.session.add(counter)
-        db.session.commit()
-    return counter
-
-def increment_meal_counter():
-    counter = get_meal_counter()
-    counter.count += 1
-    db.session.commit()
-    return counter.count
-
-def get_latest_scan_from_db():
-    latest_scan_record = ScanRecord.query.join(Faculty).order_by(ScanRecord.scanned_at.desc()).first()
-    if latest_scan_record:
-        faculty = Faculty.query.get(latest_scan_record.faculty_id)
-        return {
-            'faculty_name': faculty.name,
-            'faculty_phone_number': faculty.phone_number,
-            'faculty_department': faculty.department,
-            'scanned_at': latest_scan_record.scanned_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'scan_id': latest_scan_record.id,
-            'timestamp': latest_scan_record.scanned_at.timestamp()
-        }
-    return None
+# ``session`` is the meal session window of the scan, None outside every session
+ScanResult = namedtuple('ScanResult', 'scan_id scanned_at count blocked row session')
+
+def device_room(device):
+    """Socket.IO room joined by the counter displays of ``device``."""
+    return f'device:{device}'
+
+def faculty_cookie(device):
+    # Device 1 and 2 keep the cookie names used before multi-device support
+    return 'faculty_id' if device == '1' else f'faculty_id_{device}'
 
-# --- Helper functions for Device 2 ---
-def get_meal_counter2():
-    counter = MealCounter2.query.first()
-    if not counter:
-        counter = MealCounter2(count=0)
-        db.session.add(counter)
-        db.session.commit()
-    return counter
-
-def increment_meal_counter2():
-    counter = get_meal_counter2()
-    counter.count += 1
-    db.session.commit()
-    return counter.count
-
-def get_latest_scan_from_db2():
-    latest_scan_record = ScanRecord2.query.join(Faculty2).order_by(ScanRecord2.scanned_at.desc()).first()
-    if latest_scan_record:
-        faculty = Faculty2.query.get(latest_scan_record.faculty_id)
-        return {
-            'faculty_name': faculty.name,
-            'faculty_phone_number': faculty.phone_number,
-            'faculty_department': faculty.department,
-            'scanned_at': latest_scan_record.scanned_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'scan_id': latest_scan_record.id,
-            'timestamp': latest_scan_record.scanned_at.timestamp()
-        }
+def current_faculty(device):
+    """Faculty identified by this device's cookie, served from the faculty cache."""
+    faculty_id = request.cookies.get(faculty_cookie(device))
+    if faculty_id:
+        faculty = faculty_cache.lookup(faculty_id)
+        if faculty and faculty.device == device:
+            return faculty
     return None
 
+def scan_row(scan_id, scanned_at, faculty):
+    """JSON-ready summary of a scan, as sent to displays and the dashboard."""
+    return {
+        'faculty_name': faculty.name,
+        'faculty_phone_number': faculty.phone_number,
+        'faculty_department': faculty.department,
+        'scanned_at': scanned_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'scan_id': scan_id,
+        'timestamp': scanned_at.timestamp()
+    }
+
+def stage_scan(device, faculty, now):
+    """Run the statements of a scan in the current transaction, without committing."""
+    faculty_id = faculty.id
+    counter = meal_counters[device]
+    scan_id = str(uuid.uuid4())
+    window = meal_schedule.current(now)
+    if served_index.active:
+        # record_scan has already claimed this session for the faculty member
+        db.session.execute(db.insert(ScanRecord).values(
+            id=scan_id, faculty_id=faculty_id, scanned_at=now, device=device))
+    else:
+        # Check and insert in one statement, so concurrent scans cannot both get through
+        in_session = (ScanRecord.faculty_id == faculty_id, ScanRecord.scanned_at >= window.start,
+                      ScanRecord.scanned_at < window.end)
+        insert = db.insert(ScanRecord).from_select(
+            ['id', 'faculty_id', 'scanned_at', 'device'],
+            db.select(
+                db.literal(scan_id, db.String),
+                db.literal(faculty_id, db.String),
+                db.literal(now, db.DateTime),
+                db.literal(device, db.String),
+            ).where(~db.select(ScanRecord.id).where(*in_session).exists()),
+        )
+        if db.session.execute(insert).rowcount == 0:
+            served_at = db.session.execute(
+                db.select(db.func.min(ScanRecord.scanned_at)).where(*in_session)
+            ).scalar()
+            return ScanResult(None, served_at, None, True, None, window)
+
+    count = counter.increment()
+    rollup.record_scan(device, faculty_id, now)
+    return ScanResult(scan_id, now, count, False, None, window)
+
+def publish_scan(device, faculty, result):
+    """Update the in-process caches once a staged scan has committed."""
+    if result.blocked:
+        return result
+    meal_counters[device].remember(result.count)
+    row = scan_row(result.scan_id, result.scanned_at, faculty)
+    # Cache first, so a poll carrying the new version never sees the old rows
+    recent_scans.push(device, row)
+    data_versions.bump(device)
+    return result._replace(row=row)
+
+# SCAN_WRITE_MODE=group funnels scans through one writer thread that commits
+# them in batches (see ingest.ScanWriter); the default commits each request's scan itself
+scan_writer = None
+if os.environ.get('SCAN_WRITE_MODE', 'direct') == 'group':
+    scan_writer = ScanWriter(
+        app, stage_scan, publish_scan,
+        interval=int(os.environ.get('SCAN_GROUP_COMMIT_MS', 5)) / 1000,
+        max_batch=int(os.environ.get('SCAN_GROUP_COMMIT_MAX', 64)),
+    )
+
+# --- Metrics, served in the Prometheus text format on /metrics ---
+# Each worker process keeps its own; scrape every process separately.
+metrics_registry = metrics.Registry()
+request_metrics = metrics.RequestMetrics(metrics_registry)
+# Registered before the other request hooks so early redirects are timed too
+request_metrics.init_app(app)
+
+tts_seconds = metrics_registry.histogram(
+    'canteen_tts_synthesis_seconds', 'Time a TTS worker spent on a job, by engine',
+    labelnames=('engine',))
+tts_jobs = metrics_registry.counter(
+    'canteen_tts_jobs_total', 'TTS worker jobs by engine and outcome (festival means espeak failed)',
+    labelnames=('engine', 'outcome'))
+
+def observe_tts(seconds, engine, error):
+    engine = engine or ('none' if error else 'cache')
+    tts_seconds.observe(seconds, engine=engine)
+    tts_jobs.inc(engine=engine, outcome='error' if error else 'ok')
+
+tts_executor.observer = observe_tts
+
+emit_seconds = metrics_registry.histogram(
+    'canteen_socketio_emit_seconds', 'Time to emit one event batch to a device room',
+    labelnames=('device',), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+emitted_events = metrics_registry.counter(
+    'canteen_socketio_events_total', 'Events sent to displays in batches', labelnames=('device',))
+
+def observe_emit(device, seconds, events):
+    emit_seconds.observe(seconds, device=device)
+    emitted_events.inc(events, device=device)
+
+event_batcher.observer = observe_emit
+
+def socketio_clients():
+    if socketio.server is None:
+        return {}
+    rooms = socketio.server.manager.rooms
+    return {namespace: len(rooms[namespace].get(None, ())) for namespace in list(rooms)}
+
+def socketio_room_clients():
+    if socketio.server is None:
+        return {}
+    rooms = socketio.server.manager.rooms.get('/', {})
+    return {device: len(rooms.get(device_room(device), ())) for device in DEVICES}
+
+metrics_registry.gauge('canteen_socketio_clients', 'Connected Socket.IO clients, by namespace',
+                       socketio_clients, labelnames=('namespace',))
+metrics_registry.gauge('canteen_socketio_device_clients', 'Counter displays connected, by device',
+                       socketio_room_clients, labelnames=('device',))
+metrics_registry.gauge('canteen_tts_queue_depth', 'TTS jobs waiting for a worker',
+                       lambda: {(): tts_executor.stats()['queue_depth']})
+metrics_registry.gauge('canteen_startup_step_seconds', 'Time each startup step took in this process',
+                       lambda: startup.stats()['steps'], labelnames=('step',))
+if scan_writer is not None:
+    metrics_registry.gauge('canteen_scan_writer_queue_depth', 'Scans waiting for the group-commit writer',
+                           lambda: {(): scan_writer.stats()['queue_depth']})
+
+def record_scan(device, faculty):
+    """Record a meal for ``faculty`` at ``device``; returns a :data:`ScanResult` once committed."""
+    now = datetime.utcnow()
+    window = meal_schedule.current(now)
+    if window is None:
+        return ScanResult(None, None, None, True, None, None)
+    if served_index.active:
+        served_at = served_index.claim(device, window, faculty.id, now)
+        if served_at is not None:
+            return ScanResult(None, served_at, None, True, None, window)
+    try:
+        if scan_writer is not None:
+            # Hand this request's pooled connection back while waiting; the
+            # writer needs one, and every waiting request would otherwise hold one
+            db.session.rollback()
+            return scan_writer.submit(device, faculty, now)
+        result = stage_scan(device, faculty, now)
+        if result.blocked:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        return publish_scan(device, faculty, result)
+    except Exception:
+        if served_index.active:
+            served_index.release(device, window, faculty.id)
+        raise
+
+def recent_scans_query(device, limit):
+    return db.session.query(ScanRecord, Faculty)\
+        .join(Faculty, ScanRecord.faculty_id == Faculty.id)\
+        .filter(ScanRecord.device == device)\
+        .order_by(ScanRecord.scanned_at.desc())\
+        .limit(limit)
+
+def load_recent_scans(device, limit):
+    return [scan_row(sr.id, sr.scanned_at, f) for sr, f in recent_scans_query(device, limit)]
+
+# Newest scans per device, kept current by record_scan so the dashboard and
+# /api/recent-scans are served from memory instead of the ScanRecord/Faculty join
+recent_scans = RecentScansCache(
+    load_recent_scans,
+    DEVICES,
+    size=int(os.environ.get('RECENT_SCANS_CACHE_SIZE', 50)),
+    enabled=not SOCKETIO_MESSAGE_QUEUE,
+)
+
+def json_response(payload):
+    # Pre-serialized bodies from the recent scans cache are sent as they are
+    if isinstance(payload, bytes):
+        return Response(payload, mimetype='application/json')
+    return jsonify(payload)
+
+def versioned_json(device, build, variant=''):
+    """JSON response tagged with the device's data version; a matching If-None-Match gets 304."""
+    version = data_versions.get(device)
+    if version is None:
+        return json_response(build())
+    etag, modified = version
+    # For data that also changes without a scan, such as "today"
+    if variant:
+        etag = f'{etag}-{variant}'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = json_response(build())
+    response.set_etag(etag)
+    response.last_modified = modified
+    # Browsers revalidate every poll instead of reusing a stale copy
+    response.cache_control.no_cache = True
+    return response
+
+def latest_scan(device):
+    latest = recent_scans.rows(device, 1)
+    return latest[0] if latest else None
+
 @app.before_request
 def before_request():
     # Handle reverse proxy and ensure proper URL generation
@@ -165,9 +413,49 @@ def before_request():
         secure_url = request.url.replace('http://', 'https://', 1)
         return redirect(secure_url, code=301)
 
+@app.before_request
+def wait_for_startup():
+    # Static files, metrics and startup progress never touch the database
+    if request.endpoint in ('static', 'asset', 'prometheus_metrics', 'startup_stats') or startup.wait(STARTUP_TIMEOUT):
+        return None
+    response = jsonify({'error': 'Starting up, please retry'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+@app.url_value_preprocessor
+def check_device(endpoint, values):
+    # /d/<device>/... only serves the counters listed in CANTEEN_DEVICES
+    if values and 'device' in values and values['device'] not in DEVICES:
+        abort(404)
+
+def query_device():
+    """The ?device= of a request (device 1 if absent), 404 unless in CANTEEN_DEVICES."""
+    device = request.args.get('device', '1')
+    if device not in DEVICES:
+        abort(404)
+    return device
+
+def admin_authorized():
+    # Constant-time comparison, so response timing does not leak the token
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+def admin_required(view):
+    """Restrict a view to requests with the X-Admin-Token header: 401 without it, 403 if wrong."""
+    @functools.wraps(view)
+    def wrapped(*args, **kwargs):
+        if 'X-Admin-Token' not in request.headers:
+            return jsonify({'error': 'Admin token required'}), 401
+        if not admin_authorized():
+            return jsonify({'error': 'Forbidden'}), 403
+        return view(*args, **kwargs)
+    return wrapped
+
 # --- Routes ---
-@app.route('/register', methods=['GET', 'POST'])
-def register():
+# Every counter is served by /d/<device>/...; the original URLs stay as aliases for devices 1 and 2
+@app.route('/d/<device>/register', methods=['GET', 'POST'])
+def device_register(device):
     if request.method == 'POST':
         try:
             name = request.form.get('name', '').strip()
@@ -177,18 +465,22 @@ def register():
             if not all([name, phone_number, department]):
                 return render_template('register.html', error="All fields are required")
 
-            existing_faculty = Faculty.query.filter_by(phone_number=phone_number).first()
+            existing_faculty = Faculty.query.filter_by(device=device, phone_number=phone_number).first()
             if existing_faculty:
-                response = make_response(redirect(url_for('register_success', _external=False)))
-                response.set_cookie('faculty_id', existing_faculty.id, max_age=60*60*24*365, secure=True, httponly=True, samesite='Lax')
+                response = make_response(redirect(url_for('device_register_success', device=device, _external=False)))
+                response.set_cookie(faculty_cookie(device), existing_faculty.id, max_age=60*60*24*365, secure=True, httponly=True, samesite='Lax')
                 return response
 
-            faculty = Faculty(name=name, phone_number=phone_number, department=department)
+            faculty = Faculty(name=name, phone_number=phone_number, department=department, device=device, registration_date=datetime.utcnow())
             db.session.add(faculty)
+            rollup.record_registration(device, faculty.registration_date)
             db.session.commit()
+            data_versions.bump(device)
+            # Synthesize the name now so the first scan announcement is a cache hit
+            tts_executor.warm(faculty.name)
 
-            response = make_response(redirect(url_for('register_success', _external=False)))
-            response.set_cookie('faculty_id', faculty.id, max_age=60*60*24*365, secure=True, httponly=True, samesite='Lax')
+            response = make_response(redirect(url_for('device_register_success', device=device, _external=False)))
+            response.set_cookie(faculty_cookie(device), faculty.id, max_age=60*60*24*365, secure=True, httponly=True, samesite='Lax')
             return response
             
         except Exception as e:
@@ -197,513 +489,767 @@ def register():
 
     return render_template('register.html')
 
-@app.route('/register-success')
-def register_success():
-    faculty_id = request.cookies.get('faculty_id')
-    if faculty_id:
-        faculty = Faculty.query.get(faculty_id)
-        if faculty:
-            return render_template('register_success.html', faculty=faculty)
-    return redirect(url_for('register', _external=False))
-
-@app.route('/scan')
-def scan():
+@app.route('/d/<device>/enroll/<token>')
+def device_enroll(device, token):
     try:
-        faculty_id = request.cookies.get('faculty_id')
-        
-        if not faculty_id:
-            return redirect(url_for('register', _external=False))
+        faculty_id = enrollment_signer.verify(token, device)
+    except onboarding.EnrollmentInvalid as e:
+        log.info('enrollment link rejected', extra={'fields': {'device': device, 'reason': str(e)}})
+        return render_template('success.html', title="Link Expired",
+                               message="This registration link is no longer valid. Please register with the form.")
+    faculty = faculty_cache.lookup(faculty_id)
+    if not faculty or faculty.device != device:
+        return redirect(url_for('device_register', device=device, _external=False))
+    response = make_response(redirect(url_for('device_register_success', device=device, _external=False)))
+    response.set_cookie(faculty_cookie(device), faculty.id, max_age=60*60*24*365, secure=True, httponly=True, samesite='Lax')
+    return response
+
+def public_url(endpoint, base_url=None, **values):
+    """Absolute URL of ``endpoint`` under ``base_url`` or BASE_URL, else the request host."""
+    base_url = (base_url or BASE_URL).rstrip('/')
+    if not base_url:
+        return url_for(endpoint, _external=True, **values)
+    base = urllib.parse.urlsplit(base_url)
+    urls = app.url_map.bind(base.netloc, script_name=base.path or '/', url_scheme=base.scheme)
+    return urls.build(endpoint, values, force_external=True)
+
+# Pages a printed QR code can point at
+QR_KINDS = {'scan': 'device_scan', 'register': 'device_register', 'counter': 'device_counter'}
+
+@app.route('/qr/<device>/<kind>')
+def device_qr(device, kind):
+    if kind not in QR_KINDS:
+        abort(404)
+    fmt = request.args.get('format', 'png')
+    if fmt not in qr.FORMATS:
+        return jsonify({'error': 'format must be png or svg'}), 400
+    try:
+        key, data = qr_cache.get(public_url(QR_KINDS[kind], device=device), fmt)
+        response = Response(data, mimetype=qr.FORMATS[fmt])
+        response.set_etag(key)
+        response.cache_control.public = True
+        response.cache_control.max_age = 86400
+        return response.make_conditional(request)
+    except Exception as e:
+        log.exception('QR code failed', extra={'fields': {'device': device, 'kind': kind, 'format': fmt}})
+        return jsonify({'error': f'Failed to render QR code for device {device}'}), 500
+
+@app.route('/d/<device>/register-success')
+def device_register_success(device):
+    faculty = current_faculty(device)
+    if faculty:
+        return render_template('register_success.html', faculty=faculty)
+    return redirect(url_for('device_register', device=device, _external=False))
+
+@app.route('/d/<device>/scan')
+def device_scan(device):
+    try:
+        if not request.cookies.get(faculty_cookie(device)):
+            return redirect(url_for('device_register', device=device, _external=False))
         
-        faculty = Faculty.query.get(faculty_id)
+        faculty = current_faculty(device)
         if not faculty:
-            response = make_response(redirect(url_for('register', _external=False)))
-            response.set_cookie('faculty_id', '', expires=0)
+            response = make_response(redirect(url_for('device_register', device=device, _external=False)))
+            response.set_cookie(faculty_cookie(device), '', expires=0)
             return response
 
-        # Enforce a 6-hour cooldown between scans to prevent duplicates
-        cooldown = timedelta(hours=6)
-        window_start = datetime.utcnow() - cooldown
-        # Check for any scan within the cooldown window
-        recent_scan = ScanRecord.query.filter(ScanRecord.faculty_id == faculty.id, ScanRecord.scanned_at >= window_start).order_by(ScanRecord.scanned_at.desc()).first()
-        if recent_scan:
-            time_since_last_scan = datetime.utcnow() - recent_scan.scanned_at
-            next_scan_time = recent_scan.scanned_at + cooldown
-            print(f"Scan blocked for faculty {faculty.id} ({faculty.name}). Last scan at {recent_scan.scanned_at}, {time_since_last_scan} ago. Next allowed at {next_scan_time}")
-            return render_template('already_scanned.html', faculty=faculty, last_scan=recent_scan, next_scan_time=next_scan_time)
-
-        # No recent scan found in the cooldown window; create a new scan record
-        scan_record = ScanRecord(faculty_id=faculty.id)
-        db.session.add(scan_record)
-        db.session.commit()
-        
-        # Emit socket events for real-time updates
-        latest_scan_data = {
-            'faculty_name': faculty.name,
-            'faculty_phone_number': faculty.phone_number,
-            'faculty_department': faculty.department,
-            'scanned_at': scan_record.scanned_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'scan_id': scan_record.id,
-            'timestamp': scan_record.scanned_at.timestamp()
-        }
+        # One meal per faculty member per meal session
+        result = record_scan(device, faculty)
+        if result.blocked:
+            upcoming = meal_schedule.upcoming(datetime.utcnow())
+            if result.session is None:
+                log.info('scan outside meal sessions', extra={'fields': {
+                    'device': device, 'faculty_id': faculty.id, 'next_session': upcoming.name}})
+                return render_template('success.html', title="No Meal Being Served",
+                                       message=f"{upcoming.name.capitalize()} starts at {format_time(upcoming.start)}.")
+            log.info('scan blocked', extra={'fields': {
+                'device': device, 'faculty_id': faculty.id, 'session': result.session.name,
+                'served_at': result.scanned_at}})
+            return render_template('already_scanned.html', faculty=faculty, session=result.session.name,
+                                   served_at=format_time(result.scanned_at), next_session=upcoming.name,
+                                   next_time=format_time(upcoming.start))
+
+        # Queue for this device's displays; sent with the next batch
+        event_batcher.add(device, 'new_scan', result.row)
+        event_batcher.add(device, 'counter_update', {'count': result.count})
         
-        # Emit to all connected clients on default namespace
-        socketio.emit('new_scan', latest_scan_data, namespace='/')
-        
-        # Increment counter and emit update
-        current_count = increment_meal_counter()
-        socketio.emit('counter_update', {'count': current_count}, namespace='/')
-        
-        # Redirect to scan success with the created scan id so we can show timestamp
-        return redirect(url_for('scan_success', scan_id=scan_record.id, _external=False))
+        # Redirect to scan success with a signed receipt carrying what the page shows
+        receipt = receipt_signer.issue(device, faculty, result.scan_id, result.scanned_at)
+        return redirect(url_for('device_scan_success', device=device, receipt=receipt, _external=False))
         
     except Exception as e:
         # Rollback DB changes and log full traceback for debugging
         db.session.rollback()
-        import traceback
-        tb = traceback.format_exc()
-        # Print traceback to console (visible in systemd or process output)
-        print("--- Scan route exception traceback ---")
-        print(tb)
-        # Also append traceback to a log file for later inspection
-        try:
-            with open(os.path.join(os.path.dirname(__file__), 'auto_canteen.log'), 'a') as lf:
-                lf.write(f"[{datetime.utcnow().isoformat()}] Scan exception: {str(e)}\n")
-                lf.write(tb + "\n")
-        except Exception as log_e:
-            print('Failed to write to auto_canteen.log:', log_e)
+        log.exception('scan failed', extra={'fields': {'device': device}})
 
         # Return a helpful message containing the exception (temporary for debugging)
         # NOTE: remove or sanitize detailed exception messages in production
         return render_template('success.html', title="Scan Error", message=f"Scan failed: {str(e)}")
 
-@app.route('/scan-success')
-def scan_success():
-    faculty_id = request.cookies.get('faculty_id')
-    if faculty_id:
-        faculty = Faculty.query.get(faculty_id)
-        if faculty:
-            # Optionally show the recorded scan timestamp in IST if provided via query param
-            scan_id = request.args.get('scan_id')
-            scanned_at_ist = None
-            if scan_id:
-                scan_record = ScanRecord.query.get(scan_id)
-                if scan_record and scan_record.scanned_at:
-                    # The DB timestamp is UTC (naive), mark as UTC then convert to IST
-                    scanned_utc = scan_record.scanned_at.replace(tzinfo=timezone.utc)
-                    scanned_ist_dt = scanned_utc.astimezone(ZoneInfo('Asia/Kolkata'))
-                    scanned_at_ist = scanned_ist_dt.strftime('%Y-%m-%d %I:%M %p')
-            return render_template('scan_success.html', faculty=faculty, scanned_at_ist=scanned_at_ist)
-    return redirect(url_for('register', _external=False))
-
-# --- Device 2 Routes (Completely separate from Device 1) ---
-@app.route('/register2', methods=['GET', 'POST'])
-def register2():
-    if request.method == 'POST':
+@app.route('/d/<device>/scan-success')
+def device_scan_success(device):
+    receipt = request.args.get('receipt')
+    if receipt:
+        # Verified against the cookie only; no database access
         try:
-            name = request.form.get('name', '').strip()
-            phone_number = request.form.get('phone_number', '').strip()
-            department = request.form.get('department', '').strip()
+            faculty_name, scanned_at_ist = receipt_signer.verify(
+                receipt, device, request.cookies.get(faculty_cookie(device)))
+        except ReceiptInvalid as e:
+            log.info('scan receipt rejected', extra={'fields': {'device': device, 'reason': str(e)}})
+            return render_template('success.html', title="Receipt Expired",
+                                   message="This meal receipt is no longer valid. Scan again to check your status.")
+        return render_template('scan_success.html', faculty={'name': faculty_name}, scanned_at_ist=scanned_at_ist)
+
+    faculty = current_faculty(device)
+    if faculty:
+        # Links issued before receipts existed carry the scan id instead
+        scan_id = request.args.get('scan_id')
+        scanned_at_ist = None
+        if scan_id:
+            scan_record = db.session.get(ScanRecord, scan_id)
+            if scan_record and scan_record.scanned_at:
+                scanned_at_ist = format_ist(scan_record.scanned_at)
+        return render_template('scan_success.html', faculty=faculty, scanned_at_ist=scanned_at_ist)
+    return redirect(url_for('device_register', device=device, _external=False))
+
+@app.route('/d/<device>/counter')
+def device_counter(device):
+    try:
+        # Read the batch position first: batches sent after it are replayed on connect
+        stream, seq = event_batcher.position(device)
+        return render_template("counter.html", device=device, count=meal_counters[device].value(),
+                               batch_stream=stream, batch_seq=seq)
+    except Exception as e:
+        return render_template('success.html', title="Error", message=f"Failed to load counter {device}")
 
-            if not all([name, phone_number, department]):
-                return render_template('register.html', error="All fields are required")
+@app.route('/d/<device>/api/counter')
+def device_api_counter(device):
+    try:
+        return versioned_json(device, lambda: {"count": meal_counters[device].value()})
+    except Exception as e:
+        return jsonify({'error': f'Failed to fetch counter {device}'}), 500
 
-            existing_faculty = Faculty2.query.filter_by(phone_number=phone_number).first()
-            if existing_faculty:
-                response = make_response(redirect(url_for('register2_success', _external=False)))
-                response.set_cookie('faculty_id_2', existing_faculty.id, max_age=60*60*24*365, secure=True, httponly=True, samesite='Lax')
-                return response
+@app.route('/d/<device>/reset-counter', methods=["POST"])
+def device_reset_counter(device):
+    try:
+        meal_counters[device].reset()
+        data_versions.bump(device)
+        
+        # Send counter reset to this device's displays only
+        event_batcher.add(device, 'counter_update', {'count': 0})
+        return redirect(url_for("device_counter", device=device, _external=False))
+    except Exception as e:
+        db.session.rollback()
+        return render_template('success.html', title="Error", message=f"Failed to reset counter {device}")
 
-            faculty = Faculty2(name=name, phone_number=phone_number, department=department)
-            db.session.add(faculty)
-            db.session.commit()
+# --- Original single/dual device URLs ---
+@app.route('/register', methods=['GET', 'POST'])
+def register():
+    return device_register('1')
 
-            response = make_response(redirect(url_for('register2_success', _external=False)))
-            response.set_cookie('faculty_id_2', faculty.id, max_age=60*60*24*365, secure=True, httponly=True, samesite='Lax')
-            return response
-            
-        except Exception as e:
-            db.session.rollback()
-            return render_template('register.html', error="Registration failed. Please try again.")
+@app.route('/register-success')
+def register_success():
+    return device_register_success('1')
 
-    return render_template('register.html')
+@app.route('/scan')
+def scan():
+    return device_scan('1')
+
+@app.route('/scan-success')
+def scan_success():
+    return device_scan_success('1')
+
+@app.route('/register2', methods=['GET', 'POST'])
+def register2():
+    return device_register('2')
 
 @app.route('/register2-success')
 def register2_success():
-    faculty_id = request.cookies.get('faculty_id_2')
-    if faculty_id:
-        faculty = Faculty2.query.get(faculty_id)
-        if faculty:
-            return render_template('register_success.html', faculty=faculty)
-    return redirect(url_for('register2', _external=False))
+    return device_register_success('2')
 
 @app.route('/scan2')
 def scan2():
-    try:
-        faculty_id = request.cookies.get('faculty_id_2')
-        
-        if not faculty_id:
-            return redirect(url_for('register2', _external=False))
-        
-        faculty = Faculty2.query.get(faculty_id)
-        if not faculty:
-            response = make_response(redirect(url_for('register2', _external=False)))
-            response.set_cookie('faculty_id_2', '', expires=0)
-            return response
-
-        # Enforce a 6-hour cooldown between scans to prevent duplicates
-        cooldown = timedelta(hours=6)
-        window_start = datetime.utcnow() - cooldown
-        # Check for any scan within the cooldown window
-        recent_scan = ScanRecord2.query.filter(ScanRecord2.faculty_id == faculty.id, ScanRecord2.scanned_at >= window_start).order_by(ScanRecord2.scanned_at.desc()).first()
-        if recent_scan:
-            time_since_last_scan = datetime.utcnow() - recent_scan.scanned_at
-            next_scan_time = recent_scan.scanned_at + cooldown
-            print(f"Scan blocked for faculty {faculty.id} ({faculty.name}). Last scan at {recent_scan.scanned_at}, {time_since_last_scan} ago. Next allowed at {next_scan_time}")
-            return render_template('already_scanned.html', faculty=faculty, last_scan=recent_scan, next_scan_time=next_scan_time)
-
-        # No recent scan found in the cooldown window; create a new scan record
-        scan_record = ScanRecord2(faculty_id=faculty.id)
-        db.session.add(scan_record)
-        db.session.commit()
-        
-        # Emit socket events for real-time updates on device 2 namespace
-        latest_scan_data = {
-            'faculty_name': faculty.name,
-            'faculty_phone_number': faculty.phone_number,
-            'faculty_department': faculty.department,
-            'scanned_at': scan_record.scanned_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'scan_id': scan_record.id,
-            'timestamp': scan_record.scanned_at.timestamp()
-        }
-        
-        # Emit to device 2 namespace only
-        socketio.emit('new_scan', latest_scan_data, namespace='/device2')
-        
-        # Increment counter and emit update
-        current_count = increment_meal_counter2()
-        socketio.emit('counter_update', {'count': current_count}, namespace='/device2')
-        
-        # Redirect to scan success with the created scan id so we can show timestamp
-        return redirect(url_for('scan2_success', scan_id=scan_record.id, _external=False))
-        
-    except Exception as e:
-        # Rollback DB changes and log full traceback for debugging
-        db.session.rollback()
-        import traceback
-        tb = traceback.format_exc()
-        # Print traceback to console (visible in systemd or process output)
-        print("--- Scan2 route exception traceback ---")
-        print(tb)
-        # Also append traceback to a log file for later inspection
-        try:
-            with open(os.path.join(os.path.dirname(__file__), 'auto_canteen.log'), 'a') as lf:
-                lf.write(f"[{datetime.utcnow().isoformat()}] Scan2 exception: {str(e)}\n")
-                lf.write(tb + "\n")
-        except Exception as log_e:
-            print('Failed to write to auto_canteen.log:', log_e)
-
-        # Return a helpful message containing the exception (temporary for debugging)
-        # NOTE: remove or sanitize detailed exception messages in production
-        return render_template('success.html', title="Scan Error", message=f"Scan failed: {str(e)}")
+    return device_scan('2')
 
 @app.route('/scan2-success')
 def scan2_success():
-    faculty_id = request.cookies.get('faculty_id_2')
-    if faculty_id:
-        faculty = Faculty2.query.get(faculty_id)
-        if faculty:
-            # Optionally show the recorded scan timestamp in IST if provided via query param
-            scan_id = request.args.get('scan_id')
-            scanned_at_ist = None
-            if scan_id:
-                scan_record = ScanRecord2.query.get(scan_id)
-                if scan_record and scan_record.scanned_at:
-                    # The DB timestamp is UTC (naive), mark as UTC then convert to IST
-                    scanned_utc = scan_record.scanned_at.replace(tzinfo=timezone.utc)
-                    scanned_ist_dt = scanned_utc.astimezone(ZoneInfo('Asia/Kolkata'))
-                    scanned_at_ist = scanned_ist_dt.strftime('%Y-%m-%d %I:%M %p')
-            return render_template('scan_success.html', faculty=faculty, scanned_at_ist=scanned_at_ist)
-    return redirect(url_for('register2', _external=False))
+    return device_scan_success('2')
+
+@app.route("/counter")
+def show_counter():
+    return device_counter('1')
+
+@app.route("/counter2")
+def show_counter2():
+    return device_counter('2')
+
+@app.route("/api/counter")
+def api_counter():
+    return device_api_counter('1')
+
+@app.route("/api/counter2")
+def api_counter2():
+    return device_api_counter('2')
+
+@app.route("/reset-counter", methods=["POST"])
+def reset_counter():
+    return device_reset_counter('1')
+
+@app.route("/reset-counter2", methods=["POST"])
+def reset_counter2():
+    return device_reset_counter('2')
 
 @app.route('/dashboard')
 def dashboard():
+    device = query_device()
     try:
-        print("Dashboard accessed")  # Debug log
-        
-        # Test database connection
-        faculty_count = Faculty.query.count()
-        scan_count = ScanRecord.query.count()
-        print(f"Faculty count: {faculty_count}, Scan count: {scan_count}")  # Debug log
-        
-        recent_scans = db.session.query(ScanRecord, Faculty)\
-            .join(Faculty, ScanRecord.faculty_id == Faculty.id)\
-            .order_by(ScanRecord.scanned_at.desc())\
-            .limit(50).all()
-        
-        print(f"Found {len(recent_scans)} recent scans")  # Debug log
-        
-        scan_data = [{'faculty_name': f.name, 'faculty_phone_number': f.phone_number, 'faculty_department': f.department, 'scanned_at': sr.scanned_at.strftime('%Y-%m-%d %H:%M:%S'), 'scan_id': sr.id} for sr, f in recent_scans]
-        
-        return render_template('dashboard.html', scans=scan_data)
+        scan_data = recent_scans.rows(device, 50)
+        log.debug('dashboard accessed', extra={'sample': 'dashboard', 'fields': {'device': device, 'recent_scans': len(scan_data)}})
+        return render_template('dashboard.html', scans=scan_data, device=device)
     except Exception as e:
-        print(f"Dashboard error: {e}")  # Debug log
+        log.exception('dashboard failed')
         return render_template('success.html', title="Error", message=str(e))
 
 @app.route('/api/stats')
 def stats():
+    device = query_device()
     try:
-        return jsonify({
-            'total_faculty': Faculty.query.count(),
-            'total_scans': ScanRecord.query.count(),
-            'today_scans': ScanRecord.query.filter(db.func.date(ScanRecord.scanned_at) == datetime.utcnow().date()).count()
-        })
+        # Served from the daily rollup instead of counting the scan tables
+        today = datetime.utcnow().date()
+        return versioned_json(device, lambda: rollup.stats(device, today), variant=today.isoformat())
     except Exception as e:
         return jsonify({'error': 'Failed to fetch stats'}), 500
 
 @app.route('/api/latest-scan')
 def get_latest_scan():
+    device = query_device()
     try:
-        latest_scan = get_latest_scan_from_db()
-        return jsonify(latest_scan if latest_scan else {})
+        return versioned_json(device, lambda: latest_scan(device) or {})
     except Exception as e:
         return jsonify({'error': 'Failed to fetch latest scan'}), 500
 
 @app.route('/api/recent-scans')
 def get_recent_scans():
+    device = query_device()
     try:
-        recent_scans = db.session.query(ScanRecord, Faculty)\
-            .join(Faculty, ScanRecord.faculty_id == Faculty.id)\
-            .order_by(ScanRecord.scanned_at.desc())\
-            .limit(20).all()
-        scan_data = [{'faculty_name': f.name, 'faculty_phone_number': f.phone_number, 'faculty_department': f.department, 'scanned_at': sr.scanned_at.strftime('%Y-%m-%d %H:%M:%S'), 'scan_id': sr.id, 'timestamp': sr.scanned_at.timestamp()} for sr, f in recent_scans]
-        return jsonify(scan_data)
+        return versioned_json(device, lambda: recent_scans.body(device, 20))
     except Exception as e:
         return jsonify({'error': 'Failed to fetch recent scans'}), 500
-@app.route("/counter")
-def show_counter():
+
+@app.route('/api/scans')
+@admin_required
+def api_scans():
+    # Scan history, newest first; pass next_cursor back as ?cursor= for the next page
     try:
-        counter = get_meal_counter()
-        return render_template("counter.html", count=counter.count)
+        try:
+            limit = min(max(int(request.args.get('limit', 100)), 1), 500)
+        except ValueError:
+            raise history.HistoryQueryError('limit must be a number')
+        scans, next_cursor = history.page(limit, request.args.get('cursor'),
+                                          **history.filters_from(request.args))
+        return jsonify({'scans': scans, 'next_cursor': next_cursor})
+    except history.HistoryQueryError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        return render_template('success.html', title="Error", message="Failed to load counter")
+        log.exception('scan history failed')
+        return jsonify({'error': 'Failed to fetch scans'}), 500
 
-@app.route("/counter2")
-def show_counter2():
+@app.route('/api/scans/export')
+@admin_required
+def export_scans():
+    # Streamed row by row from a server-side cursor, for monthly billing
     try:
-        counter = get_meal_counter2()
-        return render_template("counter2.html", count=counter.count)
+        export_format = request.args.get('format', 'csv')
+        if export_format not in history.EXPORT_FORMATS:
+            raise history.HistoryQueryError('format must be csv or ndjson')
+        encode, mimetype = history.EXPORT_FORMATS[export_format]
+        rows = history.iter_scans(**history.filters_from(request.args))
+        response = Response(stream_with_context(encode(rows)), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename=scans.{export_format}'
+        return response
+    except history.HistoryQueryError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        return render_template('success.html', title="Error", message="Failed to load counter2")
+        log.exception('scan export failed')
+        return jsonify({'error': 'Failed to export scans'}), 500
 
-@app.route("/audio-diagnostic")
-def audio_diagnostic():
+def analytics_devices():
+    device = request.args.get('device')
+    return [device] if device else DEVICES
+
+@app.route('/api/analytics/daily')
+@admin_required
+def analytics_daily():
+    # Meals per IST day and device, e.g. ?from=2026-09-01&to=2026-09-30&department=CSE
     try:
-        return render_template("audio_diagnostic.html")
+        start, end = analytics.days_from(request.args)
+        days = analytics.daily(start, end, analytics_devices(), request.args.get('department') or None)
+        return jsonify({'from': start.isoformat(), 'to': end.isoformat(), 'days': days})
+    except history.HistoryQueryError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        return render_template('success.html', title="Error", message="Failed to load audio diagnostic")
-
-@app.route("/api/counter")
-def api_counter():
+        log.exception('daily analytics failed')
+        return jsonify({'error': 'Failed to fetch daily analytics'}), 500
+
+@app.route('/api/analytics/monthly')
+@admin_required
+def analytics_monthly():
+    # Billing report, e.g. ?from=2026-04&to=2027-03&group=department; closed
+    # months come from the monthly summary tables, only open ones hit ScanRecord
     try:
-        counter = get_meal_counter()
-        return jsonify({"count": counter.count})
+        start, end = analytics.months_from(request.args)
+        group = request.args.get('group', 'faculty')
+        analytics.close_due_months(DEVICES)
+        rows = analytics.report(start, end, analytics_devices(), request.args.get('department') or None, group)
+        return jsonify({'from': f'{start:%Y-%m}', 'to': f'{end:%Y-%m}', 'group': group, 'rows': rows})
+    except history.HistoryQueryError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        return jsonify({'error': 'Failed to fetch counter'}), 500
-
-@app.route("/api/counter2")
-def api_counter2():
+        db.session.rollback()
+        log.exception('monthly analytics failed')
+        return jsonify({'error': 'Failed to fetch monthly analytics'}), 500
+
+def import_summary(report, device, base_url=None):
+    """JSON-ready import report with an enrollment link per new faculty member."""
+    def reject(r):
+        return {'line': r.line, 'reason': r.reason, 'name': r.row.get('name', ''),
+                'phone_number': r.row.get('phone_number', '')}
+    return {
+        'device': device,
+        'imported': len(report.imported),
+        'duplicates': [reject(r) for r in report.duplicates],
+        'rejects': [reject(r) for r in report.rejects],
+        'faculty': [{
+            'id': faculty_id, 'name': name, 'phone_number': phone_number, 'department': department,
+            'enroll_url': public_url('device_enroll', base_url=base_url, device=device,
+                                     token=enrollment_signer.issue(device, faculty_id)),
+        } for faculty_id, name, phone_number, department in report.imported],
+    }
+
+@app.route('/api/faculty/import', methods=['POST'])
+@admin_required
+def import_faculty():
+    # CSV with name, phone and department columns, as a "file" upload or the raw body;
+    # imported in one transaction, so a failure leaves no faculty behind
     try:
-        counter = get_meal_counter2()
-        return jsonify({"count": counter.count})
+        device = request.args.get('device', '1')
+        if device not in DEVICES:
+            return jsonify({'error': f'Unknown device {device}'}), 400
+        upload = request.files.get('file')
+        raw = upload.read() if upload else request.get_data()
+        report = onboarding.import_faculty(onboarding.read_csv(raw.decode('utf-8-sig')), device)
+        if report.imported:
+            data_versions.bump(device)
+        log.info('faculty imported', extra={'fields': {
+            'device': device, 'imported': len(report.imported),
+            'duplicates': len(report.duplicates), 'rejects': len(report.rejects)}})
+        return jsonify(import_summary(report, device))
+    except UnicodeDecodeError:
+        return jsonify({'error': 'CSV must be UTF-8'}), 400
     except Exception as e:
-        return jsonify({'error': 'Failed to fetch counter2'}), 500
+        db.session.rollback()
+        log.exception('faculty import failed', extra={'fields': {'device': device}})
+        return jsonify({'error': f'Import failed, nothing was imported: {e}'}), 500
 
-@app.route("/reset-counter", methods=["POST"])
-def reset_counter():
+@app.route('/api/cache-stats')
+def cache_stats():
     try:
-        counter = get_meal_counter()
-        counter.count = 0
-        counter.last_reset = datetime.utcnow()
-        db.session.commit()
-        
-        # Emit counter reset to all connected clients
-        socketio.emit('counter_update', {'count': 0}, namespace='/')
-        return redirect(url_for("show_counter", _external=False))
+        return jsonify({'faculty': faculty_cache.stats(), 'recent_scans': recent_scans.stats(),
+                        'served': served_index.stats()})
     except Exception as e:
-        db.session.rollback()
-        return render_template('success.html', title="Error", message="Failed to reset counter")
+        log.exception('cache stats failed')
+        return jsonify({'error': 'Failed to fetch cache stats'}), 500
 
-@app.route("/reset-counter2", methods=["POST"])
-def reset_counter2():
+@app.route('/api/startup')
+def startup_stats():
+    return jsonify(startup.stats())
+
+@app.route("/audio-diagnostic")
+def audio_diagnostic():
     try:
-        counter = get_meal_counter2()
-        counter.count = 0
-        counter.last_reset = datetime.utcnow()
-        db.session.commit()
-        
-        # Emit counter reset to device2 namespace only
-        socketio.emit('counter_update', {'count': 0}, namespace='/device2')
-        return redirect(url_for("show_counter2", _external=False))
+        return render_template("audio_diagnostic.html")
     except Exception as e:
-        db.session.rollback()
-        return render_template('success.html', title="Error", message="Failed to reset counter2")
+        return render_template('success.html', title="Error", message="Failed to load audio diagnostic")
+
+def _tts_busy_response(retry_after):
+    response = jsonify({'error': 'TTS is busy, please retry'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
 
 @app.route("/api/speak")
 def api_speak():
     """Generate speech audio using system text-to-speech with proper Raspberry Pi support"""
     try:
         text = request.args.get('text', 'Error')
-        
-        # Try to use available TTS systems
-        import subprocess
-        import tempfile
-        
-        # Try espeak first (most common on Raspberry Pi)
+        key = tts_cache_key(text)
+
+        # Audio is content-addressed by text and voice settings, so browsers may
+        # keep it forever and revalidate with the ETag instead of re-downloading
+        def cacheable(response):
+            response.set_etag(key)
+            response.cache_control.public = True
+            response.cache_control.max_age = 31536000
+            response.cache_control.immutable = True
+            return response
+
+        if key in request.if_none_match:
+            return cacheable(Response(status=304))
+
+        # Streaming sends bytes to the browser as espeak writes them to the pipe,
+        # so playback starts before synthesis has finished
+        streaming = request.args.get('stream', '1' if TTS_STREAMING else '0') != '0'
         try:
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
-                temp_file = f.name
-            
-            # Use espeak with optimized settings for Raspberry Pi
-            # -a: amplitude (0-200), -p: pitch (0-99), -s: speed (wpm)
-            # Added explicit UTF-8 handling for compatibility
-            espeak_cmd = ['espeak', '-w', temp_file, '-a', '200', '-s', '150', text]
-            print(f"TTS: Running espeak command: {' '.join(espeak_cmd)}")
-            
-            subprocess.run(
-                espeak_cmd,
-                check=True,
-                timeout=15,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-            
-            # Verify file was created and has content
-            if not os.path.exists(temp_file) or os.path.getsize(temp_file) == 0:
-                print("ERROR: espeak generated empty file")
-                raise subprocess.CalledProcessError(1, 'espeak')
-            
-            # Read and return the audio file
-            with open(temp_file, 'rb') as f:
-                audio_data = f.read()
-            
-            print(f"TTS: Successfully generated {len(audio_data)} bytes of audio via espeak")
-            
-            # Clean up temp file
-            os.unlink(temp_file)
-            
-            from flask import send_file
-            from io import BytesIO
-            # CRITICAL: Ensure audio plays immediately without caching
-            response = send_file(
-                BytesIO(audio_data),
-                mimetype='audio/wav',
-                as_attachment=False,
-                download_name='speech.wav'
-            )
-            response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-            response.headers['Pragma'] = 'no-cache'
-            response.headers['Expires'] = '0'
+            if streaming:
+                key, chunks, complete = tts_executor.stream(text)
+                chunks = iter(chunks)
+                # Wait for the first bytes so a missing synthesizer still gets a proper status
+                first_chunk = next(chunks)
+            else:
+                key, audio_data, complete = tts_executor.speak(text)
+        except TTSBusy as e:
+            return _tts_busy_response(e.retry_after)
+        except TimeoutError:
+            return _tts_busy_response(tts_executor.wait_timeout)
+        except TTSUnavailable:
+            # If we get here, no TTS system is available
+            log.critical('no TTS engine available; on Raspberry Pi install with: sudo apt-get install espeak espeak-ng')
+            return jsonify({'error': 'TTS not available - install espeak with: sudo apt-get install espeak'}), 501
+
+        if not complete:
+            # Chunked or fallback-engine audio; no ETag, since festival output is
+            # never stored under the key and must not revalidate against it
+            body = itertools.chain([first_chunk], chunks) if streaming else audio_data
+            response = Response(body, mimetype='audio/wav')
+            response.cache_control.no_cache = True
             return response
-        
-        except (subprocess.CalledProcessError, FileNotFoundError, OSError) as e:
-            print(f"WARNING: espeak failed: {e}")
-            # espeak not available or failed, try festival
-            try:
-                with tempfile.NamedTemporaryFile(suffix='.txt', delete=False, mode='w') as f:
-                    temp_file = f.name
-                    # Format text for festival
-                    f.write(f'(SayText "{text}")')
-                
-                # Use festival text2wave converter
-                output_file = temp_file.replace('.txt', '.wav')
-                festival_cmd = ['text2wave', temp_file, '-o', output_file]
-                print(f"TTS: Running festival command: {' '.join(festival_cmd)}")
-                
-                subprocess.run(
-                    festival_cmd,
-                    check=True,
-                    timeout=15,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL
-                )
-                
-                if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
-                    print("ERROR: festival generated empty file")
-                    raise subprocess.CalledProcessError(1, 'text2wave')
-                
-                with open(output_file, 'rb') as f:
-                    audio_data = f.read()
-                
-                print(f"TTS: Successfully generated {len(audio_data)} bytes of audio via festival")
-                
-                # Clean up temp files
-                os.unlink(temp_file)
-                os.unlink(output_file)
-                
-                from flask import send_file
-                from io import BytesIO
-                response = send_file(
-                    BytesIO(audio_data),
-                    mimetype='audio/wav',
-                    as_attachment=False,
-                    download_name='speech.wav'
-                )
-                response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-                response.headers['Pragma'] = 'no-cache'
-                response.headers['Expires'] = '0'
-                return response
-                
-            except (subprocess.CalledProcessError, FileNotFoundError, OSError) as e:
-                print(f"WARNING: festival also failed: {e}")
-                # Clean up if files exist
-                try:
-                    os.unlink(temp_file)
-                except:
-                    pass
-        
-        # If we get here, no TTS system is available
-        print("CRITICAL: No TTS system available (espeak and festival not installed)")
-        print("On Raspberry Pi, install with: sudo apt-get install espeak espeak-ng")
-        return jsonify({'error': 'TTS not available - install espeak with: sudo apt-get install espeak'}), 501
-        
+
+        if streaming:
+            audio_data = first_chunk
+        response = make_response(audio_data)
+        response.mimetype = 'audio/wav'
+        return cacheable(response).make_conditional(request)
+
     except Exception as e:
-        import traceback
-        print(f"TTS error: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
+        log.exception('TTS request failed')
         return jsonify({'error': f'TTS generation failed: {str(e)}'}), 500
 
+# Vendored files already reported as served from the CDN, logged once per process
+cdn_fallbacks = set()
+
+@app.template_global()
+def asset_url(name):
+    """URL of the hashed copy of assets/<name>, for templates."""
+    hashed = static_assets.url_name(name)
+    if hashed is None:
+        # Vendored file not fetched yet: use its CDN copy, which an offline network cannot reach
+        if name not in cdn_fallbacks:
+            cdn_fallbacks.add(name)
+            log.error('vendored asset missing, pages load it from the CDN; run vendor-assets',
+                      extra={'fields': {'asset': name, 'url': assets.VENDOR[name]}})
+        return assets.VENDOR[name]
+    return url_for('asset', filename=hashed)
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    found = static_assets.find(filename, request.accept_encodings)
+    if found is None:
+        abort(404)
+    path, mimetype, encoding = found
+    # The name changes whenever the content does, so browsers never need to revalidate
+    response = send_file(path, mimetype=mimetype, download_name=filename, conditional=True,
+                         max_age=31536000)
+    response.cache_control.immutable = True
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route("/api/tts-stats")
+def api_tts_stats():
+    try:
+        return jsonify(dict(tts_executor.stats(), cache=tts_cache.stats()))
+    except Exception as e:
+        log.exception('TTS stats failed')
+        return jsonify({'error': 'Failed to fetch TTS stats'}), 500
+
 # Socket.IO event handlers
+# Displays join their device's room and pass the last batch they applied to catch up
 @socketio.on('connect')
-def handle_connect():
-    print(f"Client connected: {request.sid}")
-    # Send current counter value to newly connected client
-    emit('counter_update', {'count': get_meal_counter().count})
+def handle_connect(auth=None):
+    auth = auth or {}
+    device = str(auth.get('device') or request.args.get('device') or '1')
+    if device not in DEVICES or not startup.wait(STARTUP_TIMEOUT):
+        return False
+    seq = auth.get('seq')
+    replayed = event_batcher.subscribe(
+        device, request.sid,
+        snapshot=lambda: {'count': meal_counters[device].value()},
+        stream=auth.get('stream'),
+        seq=seq if isinstance(seq, int) else None,
+    )
+    log.info('display connected', extra={'sample': 'socket_connect', 'fields': {
+        'sid': request.sid, 'device': device, 'replayed': replayed}})
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    print(f"Client disconnected: {request.sid}")
-
-# Socket.IO event handlers for Device 2 (separate namespace)
-@socketio.on('connect', namespace='/device2')
-def handle_connect_device2():
-    print(f"Device2 client connected: {request.sid}")
-    # Send current counter value to newly connected device2 client
-    emit('counter_update', {'count': get_meal_counter2().count}, namespace='/device2')
-
-@socketio.on('disconnect', namespace='/device2')
-def handle_disconnect_device2():
-    print(f"Device2 client disconnected: {request.sid}")
-
-# Initialize database
-with app.app_context():
+    log.info('display disconnected', extra={'sample': 'socket_disconnect', 'fields': {'sid': request.sid}})
+
+@app.cli.command('backfill-rollup')
+def backfill_rollup_command():
+    """Rebuild the daily stats rollup from the full scan history."""
+    startup.wait()
+    rows = rollup.rebuild()
+    print(f"Rebuilt {rows} daily rollup rows")
+
+@app.cli.command('migrate-devices')
+def migrate_devices_command():
+    """Move the legacy Device 2 tables into the device-aware schema."""
+    steps = upgrade_to_devices()
+    print('\n'.join(steps) if steps else 'Schema already up to date')
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Write the hashed and precompressed copies of assets/ (also done on startup)."""
+    manifest = static_assets.build()
+    for name, hashed in sorted(manifest.items()):
+        print(f"{name} -> {hashed}")
+    missing = static_assets.missing_vendor()
+    if missing:
+        click.secho(f"WARNING: not vendored, pages load these from the CDN: {', '.join(missing)} "
+                    f"(run vendor-assets and commit assets/vendor/)", fg='red', err=True)
+    if assets.brotli is None:
+        print("brotli is not installed; only gzip variants were written")
+
+@app.cli.command('vendor-assets')
+@click.option('--force', is_flag=True, help='Download again even if already present')
+def vendor_assets_command(force):
+    """Download the third-party files pages use into assets/vendor/."""
     try:
-        db.create_all()
-        # Ensure counter exists
-        get_meal_counter()
-        print("Database initialized successfully")
-    except Exception as e:
-        print(f"Database initialization error: {e}")
+        fetched = static_assets.fetch_vendor(force=force)
+    except OSError as e:
+        raise click.ClickException(f'Download failed: {e}')
+    print(f"Fetched {', '.join(fetched)}" if fetched else 'All vendored files present')
+    static_assets.build()
+
+@app.cli.command('export-scans')
+@click.option('--format', 'export_format', type=click.Choice(sorted(history.EXPORT_FORMATS)), default='csv')
+@click.option('--device', help='Only this device')
+@click.option('--department', help='Only this department')
+@click.option('--from', 'start', help='First IST day, YYYY-MM-DD')
+@click.option('--to', 'end', help='Last IST day, YYYY-MM-DD')
+@click.option('--output', type=click.File('w'), default='-', help='File to write (default: stdout)')
+def export_scans_command(export_format, device, department, start, end, output):
+    """Stream scan history joined to faculty as CSV or NDJSON."""
+    startup.wait()
+    try:
+        filters = history.filters_from({'device': device, 'department': department, 'from': start, 'to': end})
+    except history.HistoryQueryError as e:
+        raise click.BadParameter(str(e))
+    encode, _ = history.EXPORT_FORMATS[export_format]
+    for chunk in encode(history.iter_scans(**filters)):
+        output.write(chunk)
+
+@app.cli.command('close-months')
+@click.option('--month', help='Close this month again, YYYY-MM (default: every ended month not closed yet)')
+@click.option('--device', 'devices', multiple=True, help='Device to close (repeatable; default: all)')
+def close_months_command(month, devices):
+    """Write the monthly billing summaries of ended months."""
+    devices = devices or DEVICES
+    startup.wait()
+    try:
+        if month:
+            month = analytics.parse_month(month)
+            results = [(month, device, analytics.close_month(month, device)[0]) for device in devices]
+        else:
+            results = analytics.close_due_months(devices)
+    except history.HistoryQueryError as e:
+        raise click.BadParameter(str(e), param_hint='--month')
+    for closed_month, device, meals in results:
+        print(f"Closed {closed_month:%Y-%m} for device {device}: {meals} meals")
+    if not results:
+        print('No months to close')
+
+@app.cli.command('billing-report')
+@click.option('--from', 'start', help='First month, YYYY-MM (default: this month)')
+@click.option('--to', 'end', help='Last month, YYYY-MM (default: this month)')
+@click.option('--group', type=click.Choice(list(analytics.REPORT_COLUMNS)), default='department', show_default=True)
+@click.option('--device', help='Only this device')
+@click.option('--department', help='Only this department')
+@click.option('--output', type=click.File('w'), default='-', help='CSV file to write (default: stdout)')
+def billing_report_command(start, end, group, device, department, output):
+    """Meals per faculty, department or month as CSV, from the monthly summaries."""
+    try:
+        start, end = analytics.months_from({'from': start, 'to': end})
+    except history.HistoryQueryError as e:
+        raise click.BadParameter(str(e))
+    startup.wait()
+    analytics.close_due_months(DEVICES)
+    rows = analytics.report(start, end, [device] if device else DEVICES, department, group)
+    writer = csv.DictWriter(output, fieldnames=analytics.REPORT_COLUMNS[group])
+    writer.writeheader()
+    writer.writerows(rows)
+
+def require_base_url(base_url):
+    # A code or link printed with the wrong host is useless, so never guess one offline
+    if not base_url:
+        raise click.UsageError('set BASE_URL or pass --base-url, e.g. https://your-domain/auto_canteen')
+
+@app.cli.command('import-faculty')
+@click.argument('csv_file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--device', default='1', show_default=True, help='Device to register the faculty on')
+@click.option('--base-url', default=BASE_URL or None, show_default=True,
+              help='Public URL of the app, used for enrollment links (default: BASE_URL)')
+@click.option('--links', type=click.File('w'), help='Write name, phone and enrollment link CSV here')
+def import_faculty_command(csv_file, device, base_url, links):
+    """Register faculty in bulk from a name,phone,department CSV."""
+    if device not in DEVICES:
+        raise click.BadParameter(f'unknown device {device}', param_hint='--device')
+    require_base_url(base_url)
+    startup.wait()
+    report = onboarding.import_faculty(onboarding.read_csv(csv_file.read()), device)
+    summary = import_summary(report, device, base_url)
+    print(f"Imported {summary['imported']} faculty into device {device}, "
+          f"skipped {len(summary['duplicates'])} duplicates, rejected {len(summary['rejects'])} rows")
+    for r in summary['duplicates'] + summary['rejects']:
+        print(f"  line {r['line']}: {r['reason']} ({r['name']} {r['phone_number']})")
+    if links:
+        writer = csv.writer(links)
+        writer.writerow(['name', 'phone_number', 'department', 'enroll_url'])
+        for faculty in summary['faculty']:
+            writer.writerow([faculty['name'], faculty['phone_number'], faculty['department'], faculty['enroll_url']])
+
+@app.cli.command('qr-sheets')
+@click.option('--base-url', default=BASE_URL or None, show_default=True,
+              help='Public URL of the app, as encoded in the codes (default: BASE_URL)')
+@click.option('--device', 'devices', multiple=True, help='Device to include (repeatable; default: all)')
+@click.option('--faculty', is_flag=True, help='Also render an enrollment code per registered faculty member')
+@click.option('--format', 'fmt', type=click.Choice(sorted(qr.FORMATS)), default='png', show_default=True)
+@click.option('--output', type=click.Path(file_okay=False), default='qr_sheets', show_default=True)
+@click.option('--workers', type=int, help='Rendering processes (default: one per CPU)')
+def qr_sheets_command(base_url, devices, faculty, fmt, output, workers):
+    """Render printable QR code sheets for counters and faculty."""
+    devices = devices or DEVICES
+    unknown = [device for device in devices if device not in DEVICES]
+    if unknown:
+        raise click.BadParameter(f"unknown device {', '.join(unknown)}", param_hint='--device')
+    require_base_url(base_url)
+    startup.wait()
+
+    jobs = []  # (file name, caption, url)
+    for device in devices:
+        for kind, endpoint in QR_KINDS.items():
+            jobs.append((f'device-{device}-{kind}.{fmt}', f'Device {device} {kind}',
+                         public_url(endpoint, base_url=base_url, device=device)))
+    if faculty:
+        members = db.session.execute(
+            db.select(Faculty.id, Faculty.name, Faculty.phone_number, Faculty.device)
+            .where(Faculty.device.in_(devices))
+            .order_by(Faculty.device, Faculty.name)
+        ).all()
+        for member in members:
+            token = enrollment_signer.issue(member.device, member.id)
+            jobs.append((f'device-{member.device}-enroll-{member.phone_number}.{fmt}',
+                         f'{member.name} (device {member.device})',
+                         public_url('device_enroll', base_url=base_url, device=member.device, token=token)))
+
+    # Rendering is CPU-bound, so spread it over processes rather than threads
+    from concurrent.futures import ProcessPoolExecutor
+    os.makedirs(output, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        images = pool.map(qr.render, [url for _, _, url in jobs], itertools.repeat(fmt), chunksize=16)
+        for (filename, _, _), data in zip(jobs, images):
+            with open(os.path.join(output, filename), 'wb') as f:
+                f.write(data)
+
+    with open(os.path.join(output, 'sheet.html'), 'w') as f:
+        f.write('<!DOCTYPE html><html><head><meta charset="utf-8"><title>QR codes</title><style>'
+                'body{font-family:sans-serif}figure{display:inline-block;width:30%;margin:1%;text-align:center;'
+                'page-break-inside:avoid}img{width:100%}</style></head><body>\n')
+        for filename, caption, url in jobs:
+            f.write(f'<figure><img src="{escape(filename)}" alt="{escape(url)}">'
+                    f'<figcaption>{escape(caption)}</figcaption></figure>\n')
+        f.write('</body></html>\n')
+    print(f"Rendered {len(jobs)} QR codes into {output}/ (open sheet.html to print)")
+
+# --- Startup ---
+@startup.setup
+def configure_engine():
+    # Creates the engine; its hooks only register listeners, so no connection is opened yet
+    with app.app_context():
+        request_metrics.watch_engine(db.engine)
+        if os.environ.get('SQLITE_WAL', 'true').lower() == 'true':
+            configure_sqlite(db.engine, synchronous=os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'))
+        else:
+            configure_sqlite(db.engine, journal_mode=None, synchronous=os.environ.get('SQLITE_SYNCHRONOUS', 'FULL'))
+
+@startup.step('schema', required=True)
+def check_schema():
+    upgrade_to_devices()
+    ensure_schema()
+
+@startup.step('counters', required=True)
+def ensure_counters():
+    for counter in meal_counters.values():
+        counter.ensure()
+
+@startup.step('served-index', required=True)
+def load_served_index():
+    # Faculty already served in the current session, e.g. after a restart mid-lunch
+    if not served_index.enabled:
+        return
+    window = meal_schedule.current(datetime.utcnow())
+    served = []
+    if window is not None:
+        served = db.session.execute(
+            db.select(ScanRecord.device, ScanRecord.faculty_id, db.func.min(ScanRecord.scanned_at))
+            .where(ScanRecord.device.in_(DEVICES), ScanRecord.scanned_at >= window.start,
+                   ScanRecord.scanned_at < window.end)
+            .group_by(ScanRecord.device, ScanRecord.faculty_id)
+        ).all()
+    served_index.load(window, served)
+
+@startup.step('rollup', required=True)
+def ensure_rollup():
+    # First start after upgrading: build the rollup from existing history
+    if not db.session.query(DailyRollup.day).first() and db.session.query(Faculty.id).first():
+        rollup.rebuild()
+
+@startup.step('caches')
+def warm_caches():
+    # Counter values and the newest scans, read by every display and dashboard
+    for device in DEVICES:
+        meal_counters[device].value()
+        recent_scans.rows(device, 1)
+
+@startup.step('month-close')
+def close_ended_months():
+    # Month-end close-out; the monthly report also closes any month that ended since
+    analytics.close_due_months(DEVICES)
+
+@startup.step('assets')
+def build_assets():
+    static_assets.build()
+    missing = static_assets.missing_vendor()
+    if missing:
+        log.warning('vendored assets missing, pages will load them from the CDN; run vendor-assets',
+                    extra={'fields': {'assets': missing}})
+
+@startup.step('templates')
+def warm_templates():
+    # Compile every template now rather than on its first request
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+def create_app():
+    """Return the app set up for serving, with its startup steps running in the background."""
+    startup.start()
+    return app
 
 if __name__ == '__main__':
-    socketio.run(app, debug=os.environ.get('DEBUG', 'False').lower() == 'true', 
+    socketio.run(create_app(), debug=os.environ.get('DEBUG', 'False').lower() == 'true', 
                  host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,125 @@
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import threading
+import urllib.request
+
+from files import write_atomic
+
+try:
+    import brotli
+except ImportError:  # optional; without it only gzip variants are written
+    brotli = None
+
+log = logging.getLogger('auto_canteen.assets')
+
+# Third-party files vendored into assets/vendor/ by `flask --app app vendor-assets`; CDN copy until then
+VENDOR = {
+    'vendor/socket.io.min.js': 'https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.7.2/socket.io.min.js',
+}
+
+# Precompressed variants in order of preference: (Content-Encoding, file suffix)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def fingerprint(name, data):
+    """``counter.js`` -> ``counter.<12 hex digits of sha256>.js``."""
+    root, ext = os.path.splitext(name)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def _compress(encoding, data):
+    if encoding == 'gzip':
+        # mtime=0 keeps the output identical between builds
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(data, quality=11)
+    return None
+
+
+class AssetPipeline:
+    """Content-hashed, precompressed copies of ``source_dir`` written to ``output_dir``."""
+
+    def __init__(self, source_dir, output_dir, vendor=VENDOR):
+        self.source_dir = source_dir
+        self.output_dir = output_dir
+        self.vendor = vendor
+        self._manifest = None
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    def _sources(self):
+        for directory, _, filenames in os.walk(self.source_dir):
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                yield os.path.relpath(path, self.source_dir).replace(os.sep, '/'), path
+
+    def build(self):
+        """Write every source's hashed and compressed files; returns the manifest."""
+        manifest, variants = {}, {}
+        for name, path in self._sources():
+            with open(path, 'rb') as f:
+                data = f.read()
+            hashed = fingerprint(name, data)
+            target = os.path.join(self.output_dir, hashed)
+            if not os.path.exists(target):
+                write_atomic(target, data)
+            encodings = {}
+            for encoding, suffix in ENCODINGS:
+                if not os.path.exists(target + suffix):
+                    compressed = _compress(encoding, data)
+                    if compressed is None or len(compressed) >= len(data):
+                        continue
+                    write_atomic(target + suffix, compressed)
+                encodings[encoding] = target + suffix
+            manifest[name] = hashed
+            variants[hashed] = (target, encodings)
+        write_atomic(os.path.join(self.output_dir, 'manifest.json'),
+                     json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+        with self._lock:
+            self._manifest, self._variants = manifest, variants
+        log.info('assets built', extra={'fields': {'files': len(manifest)}})
+        return manifest
+
+    def _ensure_built(self):
+        with self._lock:
+            if self._manifest is not None:
+                return
+        self.build()
+
+    def url_name(self, name):
+        """Hashed file name of source ``name``, or None if there is no such source."""
+        self._ensure_built()
+        return self._manifest.get(name)
+
+    def find(self, hashed, accept_encodings):
+        """``(path, mimetype, encoding)`` of the best variant the client accepts, or None."""
+        self._ensure_built()
+        found = self._variants.get(hashed)
+        if found is None:
+            return None
+        path, encodings = found
+        mimetype = mimetypes.guess_type(hashed)[0] or 'application/octet-stream'
+        for encoding, _ in ENCODINGS:
+            if encoding in encodings and accept_encodings[encoding]:
+                return encodings[encoding], mimetype, encoding
+        return path, mimetype, None
+
+    def missing_vendor(self):
+        """Names of :data:`VENDOR` files not in assets/ yet, so pages load them from the CDN."""
+        return sorted(name for name in self.vendor if self.url_name(name) is None)
+
+    def fetch_vendor(self, force=False):
+        """Download the :data:`VENDOR` files that are missing; returns the names fetched."""
+        fetched = []
+        for name, url in self.vendor.items():
+            path = os.path.join(self.source_dir, name)
+            if os.path.exists(path) and not force:
+                continue
+            with urllib.request.urlopen(url, timeout=30) as response:
+                write_atomic(path, response.read())
+            fetched.append(name)
+        return fetched
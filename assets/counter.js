@@ -0,0 +1,505 @@
+// Counter display: announces scans and keeps the meal count live over Socket.IO,
+// polling the count API while it is not connected.
+// Page state comes from window.COUNTER, set inline by templates/counter.html.
+// Audio context for better browser compatibility
+let audioContext = null;
+let voiceEnabled = true;
+let currentCount = COUNTER.count;
+let socket = null;
+let audioInitialized = false;
+let lastSpeakTime = 0;  // Track last speak call to prevent rapid-fire requests
+
+// Initialize audio system
+function initAudio() {
+    if (audioInitialized) return;
+    audioInitialized = true;
+
+    console.log('Initializing audio system...');
+    console.log('Is secure context:', window.isSecureContext);
+    console.log('Protocol:', window.location.protocol);
+    console.log('Platform:', navigator.platform);
+    console.log('User Agent:', navigator.userAgent);
+
+    // Try to create audio context (required for some browsers)
+    try {
+        if (window.AudioContext || window.webkitAudioContext) {
+            const AudioContext = window.AudioContext || window.webkitAudioContext;
+            audioContext = new AudioContext();
+            console.log('Audio context initialized successfully');
+            console.log('Audio context state:', audioContext.state);
+            console.log('Sample rate:', audioContext.sampleRate);
+
+            // Resume audio context if suspended (crucial for Raspberry Pi)
+            if (audioContext.state === 'suspended') {
+                console.log('Audio context is suspended, will resume on user interaction');
+            }
+        }
+    } catch (e) {
+        console.log('Audio context initialization failed:', e);
+    }
+
+    // Test if speech synthesis is available
+    if (!('speechSynthesis' in window)) {
+        console.log('Speech synthesis not available');
+        voiceEnabled = false;
+        updateVoiceStatus('Voice not supported in this browser');
+        return;
+    }
+
+    console.log('Speech synthesis available, checking voices...');
+    console.log('Current voices:', window.speechSynthesis.getVoices().length);
+
+    // Check if speech synthesis is actually working
+    // Try multiple times as voices may load asynchronously
+    let voiceCheckCount = 0;
+    const checkVoices = () => {
+        voiceCheckCount++;
+        const voices = speechSynthesis.getVoices();
+        console.log(`Voice check ${voiceCheckCount}: ${voices.length} voices found`);
+
+        if (voices.length === 0 && voiceCheckCount < 10) {
+            // Retry after a delay (increased from 5 to 10 attempts for Raspberry Pi)
+            setTimeout(checkVoices, 200);
+        } else if (voices.length === 0) {
+            console.log('No voices available after multiple attempts');
+            voiceEnabled = false;
+            updateVoiceStatus('No voices - Using server TTS fallback');
+        } else {
+            console.log('Voices loaded successfully:', voices.length);
+            console.log('Available voices:', voices.map(v => v.name).join(', '));
+            updateVoiceStatus('Voice ready - Click button to activate');
+        }
+    };
+
+    checkVoices();
+}
+
+// Update voice status display
+function updateVoiceStatus(message) {
+    const statusEl = document.getElementById('voice-status');
+    if (statusEl) {
+        statusEl.textContent = message;
+    }
+}
+
+// Simple beep sound as fallback
+function playBeep() {
+    try {
+        const beep = document.getElementById('beep-sound');
+        if (beep) {
+            beep.volume = 0.5;
+            beep.play().catch(e => console.log('Beep play failed:', e));
+        }
+    } catch (e) {
+        console.log('Beep error:', e);
+    }
+}
+
+// Create beep using Web Audio API
+function playWebAudioBeep() {
+    if (!audioContext) return;
+
+    try {
+        const oscillator = audioContext.createOscillator();
+        const gainNode = audioContext.createGain();
+
+        oscillator.connect(gainNode);
+        gainNode.connect(audioContext.destination);
+
+        oscillator.frequency.value = 800;
+        oscillator.type = 'sine';
+
+        gainNode.gain.setValueAtTime(0, audioContext.currentTime);
+        gainNode.gain.linearRampToValueAtTime(0.1, audioContext.currentTime + 0.01);
+        gainNode.gain.exponentialRampToValueAtTime(0.001, audioContext.currentTime + 0.5);
+
+        oscillator.start(audioContext.currentTime);
+        oscillator.stop(audioContext.currentTime + 0.5);
+
+    } catch (e) {
+        console.log('Web Audio beep failed:', e);
+    }
+}
+
+// Speech synthesis with better error handling and Raspberry Pi support
+function speak(text) {
+    // Rate limit to prevent overwhelming the system
+    const now = Date.now();
+    if (now - lastSpeakTime < 300) {
+        console.log('Speak called too quickly, queueing...');
+        setTimeout(() => speak(text), 300);
+        return;
+    }
+    lastSpeakTime = now;
+
+    console.log('Speaking:', text);
+
+    // On Raspberry Pi, use server-side TTS directly which is more reliable
+    speakViaAPI(text);
+}
+
+// Fallback: Use server-side TTS if browser speech fails
+function speakViaAPI(text) {
+    console.log('Using server-side TTS:', text);
+    try {
+        const audioElement = new Audio();
+        audioElement.crossOrigin = 'anonymous';
+        audioElement.volume = 1.0;
+
+        const ttsUrl = `${COUNTER.speakUrl}?text=${encodeURIComponent(text)}`;
+        console.log('Loading TTS from:', ttsUrl);
+
+        audioElement.src = ttsUrl;
+
+        audioElement.onerror = (e) => {
+            console.log('Server TTS error:', audioElement.error);
+            showVisualAlert();
+        };
+
+        audioElement.onended = () => {
+            console.log('Server TTS playback ended');
+            updateVoiceStatus('Voice ready');
+        };
+
+        // Play with error handling
+        const playPromise = audioElement.play();
+        if (playPromise !== undefined) {
+            playPromise.then(() => {
+                console.log('Server TTS playback started');
+                updateVoiceStatus('Speaking...');
+            }).catch(e => {
+                console.log('Server TTS play error:', e.name, e.message);
+                showVisualAlert();
+            });
+        } else {
+            console.log('No promise returned from play()');
+            updateVoiceStatus('Speaking...');
+        }
+    } catch (e) {
+        console.log('Server TTS setup failed:', e);
+        showVisualAlert();
+    }
+}
+
+// Visual feedback for Raspberry Pi
+function showVisualAlert() {
+    const visualAlert = document.getElementById('visual-alert');
+    if (visualAlert) {
+        visualAlert.style.opacity = '1';
+        setTimeout(() => {
+            visualAlert.style.opacity = '0';
+        }, 1000);
+    }
+}
+
+// Show pop-up for scan with faculty name
+function showScanPopup(facultyName) {
+    // Remove existing popup if any
+    const existingPopup = document.querySelector('.scan-popup');
+    if (existingPopup) {
+        existingPopup.remove();
+    }
+
+    // Create popup element
+    const popup = document.createElement('div');
+    popup.className = 'scan-popup';
+    popup.textContent = '✓ ' + facultyName;
+    document.body.appendChild(popup);
+
+    // Remove popup after 3 seconds
+    setTimeout(() => {
+        popup.style.animation = 'popupSlideOut 0.3s ease';
+        setTimeout(() => {
+            popup.remove();
+        }, 300);
+    }, 3000);
+}
+
+// Update connection status: 'connected' (live socket), 'polling' or 'disconnected'
+function updateConnectionStatus(state) {
+    const statusEl = document.getElementById('connection-status');
+    if (state === 'connected') {
+        statusEl.textContent = '🟢 Live - Connected to ' + (COUNTER.deviceLabel || 'Dashboard');
+    } else if (state === 'polling') {
+        statusEl.textContent = '🟡 Polling - Count refreshes every few seconds';
+    } else {
+        state = 'disconnected';
+        statusEl.textContent = '🔴 Offline - No Connection';
+    }
+    statusEl.className = state;
+}
+
+// Handle counter updates with multiple feedback methods
+function handleCounterUpdate(newCount) {
+    const countElement = document.getElementById('count');
+    const oldCount = currentCount;
+
+    // Visual feedback
+    countElement.classList.add('count-update');
+    setTimeout(() => {
+        countElement.classList.remove('count-update');
+    }, 1000);
+
+    // Only provide audio/voice feedback for increases
+    if (newCount > oldCount) {
+        const mealDifference = newCount - oldCount;
+        let message = '';
+
+        if (mealDifference === 1) {
+            message = "Meal served. Total: " + newCount;
+        } else {
+            message = mealDifference + " meals. Total: " + newCount;
+        }
+
+        // Try voice first, then fallbacks
+        speak(message);
+
+        // Additional visual feedback
+        showVisualAlert();
+    } else if (newCount === 0 && oldCount > 0) {
+        // Counter reset
+        speak("Counter reset to zero");
+        showVisualAlert();
+    }
+
+    currentCount = newCount;
+    countElement.innerText = newCount;
+}
+
+// Announce a scanned faculty member
+function handleNewScan(scanData) {
+    console.log('New scan detected:', scanData);
+    // Show pop-up alert with faculty name
+    if (scanData.faculty_name) {
+        // Cancel any ongoing speech to prevent overlapping
+        if (speechSynthesis.speaking) {
+            speechSynthesis.cancel();
+        }
+        showScanPopup(scanData.faculty_name);
+        // Speak ONLY the faculty name
+        speak(scanData.faculty_name);
+    }
+}
+
+// Refresh count from the API while Socket.IO is not connected, e.g. when
+// its client script could not be loaded on an offline network
+async function refreshCount() {
+    if (socket && socket.connected) return;
+    try {
+        const res = await fetch(COUNTER.counterUrl);
+        const data = await res.json();
+        handleCounterUpdate(data.count);
+        updateConnectionStatus('polling');
+    } catch (error) {
+        console.error('Error fetching count:', error);
+        updateConnectionStatus('disconnected');
+    }
+}
+
+// Apply a batch of events; repeated or out-of-order batches are skipped
+// ('stream' changes when the server restarts and numbering starts over)
+// Starts at the position the page was rendered at, so the first
+// connect replays anything sent while the page was loading
+let batchStream = COUNTER.batchStream;
+let lastSeq = COUNTER.batchSeq;
+
+function applyBatch(batch) {
+    if (batch.stream === batchStream && batch.seq <= lastSeq) {
+        console.log('Skipping stale batch', batch.seq);
+        return;
+    }
+    batchStream = batch.stream;
+    lastSeq = batch.seq;
+    batch.events.forEach(function(item) {
+        if (item.event === 'new_scan') {
+            handleNewScan(item.data);
+        } else if (item.event === 'counter_update') {
+            handleCounterUpdate(item.data.count);
+        }
+    });
+}
+
+// Snapshot sent on connect when missed batches can no longer be replayed
+function applySnapshot(state) {
+    if (state.stream === batchStream && state.seq < lastSeq) {
+        return;
+    }
+    batchStream = state.stream;
+    lastSeq = state.seq;
+    handleCounterUpdate(state.count);
+}
+
+// Initialize Socket.IO for real-time updates
+function initializeSocketIO() {
+    try {
+        // Configure Socket.IO for reverse proxy environments
+        // Compute base path (e.g. '/auto_canteen') from the current pathname to form correct socket.io path
+        const pathParts = window.location.pathname.split('/').filter(p => p);
+        const basePath = pathParts.length > 0 ? '/' + pathParts[0] : '';
+        const socketPath = basePath + '/socket.io/';
+
+        const socketConfig = {
+            transports: ['websocket', 'polling'],
+            reconnection: true,
+            reconnectionDelay: 1000,
+            reconnectionDelayMax: 5000,
+            reconnectionAttempts: Infinity,
+            // For Nginx reverse proxy with Cloudflare and Raspberry Pi
+            path: socketPath,
+            secure: window.location.protocol === 'https:',
+            rejectUnauthorized: false,
+            forceNew: true,
+            // Raspberry Pi specific settings
+            upgradeTimeout: 20000,
+            rememberUpgrade: true,
+            // Joins this counter's room so only its scans are announced, and
+            // reports the last batch applied so reconnects catch up on missed scans
+            auth: function(cb) {
+                cb({ device: COUNTER.device, stream: batchStream, seq: lastSeq });
+            }
+        };
+
+        console.log('Initializing Socket.IO with config:', socketConfig);
+        socket = io(socketConfig);
+
+        socket.on('connect', function() {
+            console.log('Connected to server via Socket.IO');
+            console.log('Socket ID:', socket.id);
+            console.log('Connected with transport:', socket.io.engine.transport.name);
+            updateConnectionStatus('connected');
+        });
+
+        socket.on('disconnect', function(reason) {
+            console.log('Disconnected from server. Reason:', reason);
+            updateConnectionStatus('disconnected');
+        });
+
+        // Scans and counter changes arrive batched, in sequence order
+        socket.on('scan_batch', applyBatch);
+        socket.on('snapshot', applySnapshot);
+
+        socket.on('connect_error', function(error) {
+            console.log('Socket.IO connection error:', error);
+            updateConnectionStatus('disconnected');
+        });
+
+        socket.on('error', function(error) {
+            console.log('Socket.IO error:', error);
+        });
+
+    } catch (error) {
+        console.error('Socket.IO initialization error:', error);
+        updateConnectionStatus('disconnected');
+    }
+}
+
+// "Device 3 counter", or just "Counter" for the first device
+function counterName() {
+    return COUNTER.deviceLabel ? COUNTER.deviceLabel + ' counter' : 'Counter';
+}
+
+// Reset counter with confirmation
+function resetCounter() {
+    if (confirm('Are you sure you want to reset the ' + (COUNTER.deviceLabel ? COUNTER.deviceLabel + ' ' : '') + 'counter to zero?')) {
+        if (voiceEnabled) {
+            speak(counterName() + " reset to zero");
+        }
+        document.getElementById('reset-form').submit();
+    }
+}
+
+// Manual voice test
+function testVoice() {
+    if (voiceEnabled) {
+        speak("Voice test. " + counterName() + " system is working.");
+    } else {
+        playBeep();
+        playWebAudioBeep();
+        showVisualAlert();
+        alert("Voice not available. Using alternative alerts.");
+    }
+}
+
+// Enable audio on user interaction (required for autoplay)
+function enableAudio() {
+    console.log('Enabling audio...');
+    console.log('Audio context state:', audioContext ? audioContext.state : 'no context');
+    console.log('Voice enabled:', voiceEnabled);
+    console.log('Audio initialized:', audioInitialized);
+
+    // Resume audio context if it exists and is suspended
+    if (audioContext && audioContext.state === 'suspended') {
+        console.log('Attempting to resume audio context...');
+        audioContext.resume().then(() => {
+            console.log('✅ Audio context resumed successfully');
+        }).catch(e => {
+            console.log('❌ Failed to resume audio context:', e);
+        });
+    }
+
+    // Initialize if not done yet
+    if (!audioInitialized) {
+        console.log('Audio not initialized yet, running init...');
+        initAudio();
+    }
+
+    // Just update status without speaking (to prevent annoying announcements)
+    if (voiceEnabled && speechSynthesis.getVoices().length > 0) {
+        console.log('Browser voice available');
+        updateVoiceStatus('Voice activated - System ready');
+    } else {
+        console.log('Browser voice not available, using server TTS');
+        updateVoiceStatus('Server TTS activated - System ready');
+    }
+}
+
+// Initialize when page loads
+document.addEventListener('DOMContentLoaded', function() {
+    console.log('Counter page loaded');
+    console.log('Browser capabilities:');
+    console.log('  - Secure context:', window.isSecureContext);
+    console.log('  - Protocol:', window.location.protocol);
+    console.log('  - Speech Synthesis:', !!window.speechSynthesis);
+    console.log('  - Web Audio API:', !!(window.AudioContext || window.webkitAudioContext));
+
+    // Initialize audio systems
+    initAudio();
+
+    // Initialize with current count
+    handleCounterUpdate(COUNTER.count);
+
+    // Set up periodic refresh (fallback if Socket.IO fails)
+    setInterval(refreshCount, 5000);
+
+    // Initialize Socket.IO for real-time updates
+    initializeSocketIO();
+
+    // Enable audio on first user interaction (required for autoplay in modern browsers)
+    // Try multiple triggers for Raspberry Pi compatibility
+    const enableAudioOnce = {once: true, passive: true};
+
+    document.addEventListener('click', enableAudio, enableAudioOnce);
+    document.addEventListener('touchstart', enableAudio, enableAudioOnce);
+    document.addEventListener('keydown', enableAudio, enableAudioOnce);
+
+    // Buttons event handlers
+    const testVoiceBtn = document.getElementById('test-voice-btn');
+    if (testVoiceBtn) {
+        testVoiceBtn.addEventListener('click', function(e) {
+            e.preventDefault();
+            console.log('Test voice button clicked');
+            testVoice();
+        });
+    }
+
+    const enableAudioBtn = document.getElementById('enable-audio-btn');
+    if (enableAudioBtn) {
+        enableAudioBtn.addEventListener('click', function(e) {
+            e.preventDefault();
+            console.log('Enable audio button clicked');
+            enableAudio();
+        });
+    }
+
+    console.log('Counter page initialization complete');
+});
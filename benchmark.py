@@ -0,0 +1,292 @@
+"""Lunch-rush benchmark for the scan path, run in-process against a scratch database.
+
+    python benchmark.py --faculty 400 --concurrency 16 --json results.json
+    python benchmark.py --startup 10   # time from process start to first scan
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+LEGACY_SCAN_URLS = {'1': '/scan', '2': '/scan2'}
+HEADERS = {'X-Forwarded-Proto': 'https'}
+
+
+class TimedList(list):
+    """Socket.IO test client inbox that timestamps every delivered packet."""
+
+    def append(self, item):
+        super().append((time.perf_counter(), item))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile; 0.0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-pct * len(ordered) // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(seconds):
+    ms = [s * 1000 for s in seconds]
+    return {
+        'count': len(ms),
+        'p50_ms': round(percentile(ms, 50), 2),
+        'p95_ms': round(percentile(ms, 95), 2),
+        'p99_ms': round(percentile(ms, 99), 2),
+        'max_ms': round(max(ms), 2) if ms else 0.0,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--faculty', type=int, default=200, help='faculty registered per device')
+    parser.add_argument('--devices', default='1,2', help='comma-separated devices to scan at')
+    parser.add_argument('--concurrency', type=int, default=16, help='scans in flight at once')
+    parser.add_argument('--displays', type=int, default=2, help='counter displays connected per device')
+    parser.add_argument('--repeat', type=float, default=0.1,
+                        help='fraction of faculty who scan twice (exercises the once-per-session check)')
+    parser.add_argument('--seed', type=int, default=1, help='shuffle seed, keep fixed to compare runs')
+    parser.add_argument('--database', help='SQLite file to use (default: a fresh temporary file)')
+    parser.add_argument('--json', dest='json_path', help='also write the results to this file')
+    parser.add_argument('--startup', type=int, metavar='RUNS',
+                        help='measure time to first scan over RUNS server starts instead')
+    return parser.parse_args()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def startup_benchmark(args, canteen, scratch, device):
+    """Time fresh ``python app.py`` processes until they accept and record a scan."""
+    import onboarding
+
+    # One faculty member per run, so no run is blocked by an earlier scan
+    with canteen.app.app_context():
+        rows = ((n, {'name': f'Startup Faculty {n:05d}', 'phone_number': f'8{n:09d}', 'department': 'BENCH'})
+                for n in range(args.startup))
+        members = [faculty_id for faculty_id, _, _, _ in onboarding.import_faculty(rows, device).imported]
+    url = LEGACY_SCAN_URLS.get(device, f'/d/{device}/scan')
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+    cookie = canteen.faculty_cookie(device)
+
+    listening, first_scan = [], []
+    for faculty_id in members:
+        port = free_port()
+        env = dict(os.environ, PORT=str(port), LOG_FILE=os.path.join(scratch, 'startup.log'))
+        # Flask-SocketIO only runs its threading server from a terminal, as in DEPLOYMENT_GUIDE.md
+        terminal, stdin = os.openpty()
+        start = time.perf_counter()
+        server = subprocess.Popen([sys.executable, script], env=env, stdin=stdin, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        listened = None
+        try:
+            while time.perf_counter() - start < 60:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                try:
+                    connection.request('GET', url, headers=dict(HEADERS, Cookie=f'{cookie}={faculty_id}'))
+                    if listened is None:
+                        listened = time.perf_counter() - start
+                    response = connection.getresponse()
+                    if response.status == 302 and 'receipt=' in response.getheader('Location', ''):
+                        first_scan.append(time.perf_counter() - start)
+                        listening.append(listened)
+                        break
+                except OSError:
+                    time.sleep(0.005)
+                finally:
+                    connection.close()
+            else:
+                print(f'server on port {port} recorded no scan within 60 s', file=sys.stderr)
+                return 1
+        finally:
+            server.terminate()
+            server.wait()
+            os.close(terminal)
+            os.close(stdin)
+
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'runs': args.startup,
+        'listening': summarize(listening),
+        'first_scan': summarize(first_scan),
+    }
+    print(f"revision {results['revision'] or 'unknown'}, {args.startup} server starts")
+    for label, key in (('listening      ', 'listening'), ('first scan     ', 'first_scan')):
+        stats = results[key]
+        print(f"  {label} p50 {stats['p50_ms']} ms  p95 {stats['p95_ms']} ms  max {stats['max_ms']} ms")
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+def main():
+    args = parse_args()
+    devices = [d.strip() for d in args.devices.split(',') if d.strip()]
+    scratch = tempfile.mkdtemp(prefix='canteen-bench-')
+    database = args.database or os.path.join(scratch, 'bench.db')
+
+    # The app reads its settings from the environment on import; create_app starts it
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    os.environ.setdefault('CANTEEN_DEVICES', ','.join(sorted(set(devices) | {'1', '2'})))
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ.setdefault('TTS_CACHE_DIR', os.path.join(scratch, 'tts_cache'))
+    os.environ.setdefault('QR_CACHE_DIR', os.path.join(scratch, 'qr_cache'))
+    os.environ.setdefault('LOG_FILE', os.path.join(scratch, 'canteen.log'))
+    # Whatever the time of day, every scan falls in one meal session
+    os.environ.setdefault('MEAL_SESSIONS', 'benchmark=00:00-24:00')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as canteen
+    import onboarding
+    from sqlalchemy import event
+
+    flask_app = canteen.create_app()
+    canteen.startup.wait()
+    if args.startup:
+        return startup_benchmark(args, canteen, scratch, devices[0])
+    with flask_app.app_context():
+        population = {}
+        for device in devices:
+            rows = ((n, {'name': f'Bench Faculty {device}-{n:05d}', 'phone_number': f'9{n:09d}',
+                         'department': 'BENCH'}) for n in range(args.faculty))
+            report = onboarding.import_faculty(rows, device)
+            population[device] = [(faculty_id, name) for faculty_id, name, _, _ in report.imported]
+        engine = canteen.db.engine
+
+    # One entry per scan; repeats come after everyone's first scan, as in a real queue
+    rng = random.Random(args.seed)
+    scans = [(device, faculty_id, name) for device in devices for faculty_id, name in population[device]]
+    rng.shuffle(scans)
+    repeats = rng.sample(scans, int(len(scans) * args.repeat))
+    scans += repeats
+
+    displays = {}
+    for device in devices:
+        displays[device] = []
+        for _ in range(args.displays):
+            client = canteen.socketio.test_client(flask_app, auth={'device': device})
+            client.queue = TimedList()
+            displays[device].append(client)
+
+    statements = [0]
+    statements_lock = threading.Lock()
+
+    def count_statement(*_):
+        with statements_lock:
+            statements[0] += 1
+    event.listen(engine, 'before_cursor_execute', count_statement)
+
+    local = threading.local()
+    started_at = {}
+    outcomes = {'scanned': 0, 'blocked': 0, 'errors': 0}
+    latencies = []
+    results_lock = threading.Lock()
+
+    def scan(item):
+        device, faculty_id, name = item
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = flask_app.test_client()
+        client.set_cookie(canteen.faculty_cookie(device), faculty_id)
+        url = LEGACY_SCAN_URLS.get(device, f'/d/{device}/scan')
+        start = time.perf_counter()
+        response = client.get(url, headers=HEADERS)
+        elapsed = time.perf_counter() - start
+        if response.status_code == 302 and 'receipt=' in response.headers.get('Location', ''):
+            outcome = 'scanned'
+        elif response.status_code == 200 and b'Scan Error' not in response.data:
+            outcome = 'blocked'
+        else:
+            outcome = 'errors'
+        with results_lock:
+            outcomes[outcome] += 1
+            latencies.append(elapsed)
+            if outcome == 'scanned':
+                started_at[name] = start
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(scan, scans))
+    wall = time.perf_counter() - wall_start
+    event.remove(engine, 'before_cursor_execute', count_statement)
+
+    # Let the last event batch reach the displays
+    time.sleep(max(0.5, canteen.event_batcher.window * 4))
+
+    delivery = []
+    delivered = 0
+    for device, clients in displays.items():
+        for client in clients:
+            for received_at, packet in list(client.queue):
+                if packet['name'] != 'scan_batch':
+                    continue
+                for item in packet['args'][0]['events']:
+                    if item['event'] != 'new_scan':
+                        continue
+                    start = started_at.get(item['data']['faculty_name'])
+                    if start is not None:
+                        delivered += 1
+                        delivery.append(received_at - start)
+            client.disconnect()
+
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'config': {
+            'faculty_per_device': args.faculty, 'devices': devices, 'concurrency': args.concurrency,
+            'displays_per_device': args.displays, 'repeat': args.repeat, 'seed': args.seed,
+            'scan_write_mode': os.environ.get('SCAN_WRITE_MODE', 'direct'),
+            'event_batch_window_ms': canteen.event_batcher.window * 1000,
+        },
+        'requests': len(scans),
+        'outcomes': outcomes,
+        'wall_seconds': round(wall, 3),
+        'scans_per_second': round(len(scans) / wall, 1) if wall else 0.0,
+        'scan_latency': summarize(latencies),
+        'display_latency': summarize(delivery),
+        'display_deliveries': {'received': delivered, 'expected': outcomes['scanned'] * args.displays},
+        'sql_statements': statements[0],
+        'sql_statements_per_request': round(statements[0] / len(scans), 2) if scans else 0.0,
+    }
+
+    scan_latency, display_latency = results['scan_latency'], results['display_latency']
+    print(f"revision {results['revision'] or 'unknown'}, {len(scans)} requests at concurrency {args.concurrency}")
+    print(f"  outcomes        {outcomes['scanned']} scanned, {outcomes['blocked']} blocked, {outcomes['errors']} errors")
+    print(f"  throughput      {results['scans_per_second']} requests/s over {results['wall_seconds']} s")
+    print(f"  scan latency    p50 {scan_latency['p50_ms']} ms  p95 {scan_latency['p95_ms']} ms  "
+          f"p99 {scan_latency['p99_ms']} ms  max {scan_latency['max_ms']} ms")
+    print(f"  display latency p50 {display_latency['p50_ms']} ms  p95 {display_latency['p95_ms']} ms  "
+          f"p99 {display_latency['p99_ms']} ms  ({delivered}/{results['display_deliveries']['expected']} delivered)")
+    print(f"  SQL statements  {statements[0]} total, {results['sql_statements_per_request']} per request")
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if outcomes['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Faculty
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Immutable snapshot of a Faculty row; safe to share between request threads
+FacultyInfo = namedtuple('FacultyInfo', 'id name phone_number department device registration_date')
+
+
+class FacultyCache(TTLCache):
+    """Faculty identities by id; bulk UPDATE/DELETE callers must ``invalidate`` themselves."""
+
+    def __init__(self, max_entries=2048, ttl=300):
+        super().__init__(max_entries, ttl)
+        event.listen(Faculty, 'after_insert', self._track)
+        event.listen(Faculty, 'after_update', self._track)
+        event.listen(Faculty, 'after_delete', self._track)
+        event.listen(Session, 'after_commit', self._flush_invalidations)
+        event.listen(Session, 'after_rollback', self._discard_invalidations)
+
+    def _track(self, mapper, connection, target):
+        # Drop the entry now and again after commit, so a concurrent reader
+        # cannot re-cache the old row while this transaction is open
+        self.invalidate(target.id)
+        session = Session.object_session(target)
+        if session is not None:
+            session.info.setdefault('faculty_cache_invalidate', set()).add(target.id)
+
+    def _flush_invalidations(self, session):
+        for faculty_id in session.info.pop('faculty_cache_invalidate', ()):
+            self.invalidate(faculty_id)
+
+    def _discard_invalidations(self, session):
+        session.info.pop('faculty_cache_invalidate', None)
+
+    def lookup(self, faculty_id):
+        """Return a :class:`FacultyInfo` for ``faculty_id``, or None if unknown."""
+        info = self.get(faculty_id)
+        if info is None:
+            faculty = db.session.get(Faculty, faculty_id)
+            if faculty is None:
+                return None
+            info = FacultyInfo(faculty.id, faculty.name, faculty.phone_number,
+                               faculty.department, faculty.device, faculty.registration_date)
+            self.set(faculty_id, info)
+        return info
+
+
+class DataVersions:
+    """Per-device ETag versions for the polling endpoints; ``get`` is None when disabled."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._token = uuid.uuid4().hex[:8]
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._started = datetime.utcnow().replace(microsecond=0)
+
+    def bump(self, device):
+        with self._lock:
+            number = self._versions.get(device, (0, None))[0] + 1
+            self._versions[device] = (number, datetime.utcnow().replace(microsecond=0))
+
+    def get(self, device):
+        if not self.enabled:
+            return None
+        with self._lock:
+            number, modified = self._versions.get(device, (0, self._started))
+        return f'{self._token}-{device}-{number}', modified
+
+
+class RecentScansCache:
+    """Write-through cache of the newest ``size`` scans of each configured device."""
+
+    def __init__(self, loader, devices, size=50, enabled=True):
+        self.loader = loader
+        self.devices = frozenset(devices)
+        self.size = size
+        self.enabled = enabled
+        self._rows = {}
+        self._bodies = {}
+        self._generation = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        event.listen(Faculty, 'after_update', self._track)
+        event.listen(Faculty, 'after_delete', self._track)
+        event.listen(Session, 'after_commit', self._flush_invalidations)
+        event.listen(Session, 'after_rollback', self._discard_invalidations)
+
+    def _track(self, mapper, connection, target):
+        self.clear()
+        session = Session.object_session(target)
+        if session is not None:
+            session.info['recent_scans_invalidate'] = True
+
+    def _flush_invalidations(self, session):
+        if session.info.pop('recent_scans_invalidate', False):
+            self.clear()
+
+    def _discard_invalidations(self, session):
+        session.info.pop('recent_scans_invalidate', None)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._bodies.clear()
+            for device in self._generation:
+                self._generation[device] += 1
+
+    def _load(self, device):
+        with self._lock:
+            rows = self._rows.get(device)
+            if rows is not None:
+                self.hits += 1
+                return rows
+            self.misses += 1
+            generation = self._generation.get(device, 0)
+        rows = list(self.loader(device, self.size))
+        if self.enabled and device in self.devices:
+            with self._lock:
+                # A scan pushed while the query ran may be missing from it
+                if self._generation.get(device, 0) == generation:
+                    self._rows[device] = rows
+        return rows
+
+    def rows(self, device, limit):
+        """Return the newest ``limit`` rows, newest first."""
+        return self._load(device)[:limit]
+
+    def body(self, device, limit):
+        """Return the newest ``limit`` rows as serialized JSON bytes."""
+        with self._lock:
+            body = self._bodies.get((device, limit))
+            if body is not None:
+                self.hits += 1
+                return body
+        rows = self._load(device)
+        body = json.dumps(rows[:limit], separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            # Only keep it if no scan was pushed while serializing
+            if self._rows.get(device) is rows:
+                self._bodies[(device, limit)] = body
+        return body
+
+    def push(self, device, row):
+        """Add a committed scan; rows are kept ordered by ``timestamp``."""
+        with self._lock:
+            self._generation[device] = self._generation.get(device, 0) + 1
+            for key in [key for key in self._bodies if key[0] == device]:
+                del self._bodies[key]
+            rows = self._rows.get(device)
+            if rows is None:
+                return
+            if any(existing['scan_id'] == row['scan_id'] for existing in rows):
+                return
+            # Concurrent scans may commit out of order; usually lands at index 0
+            position = 0
+            while position < len(rows) and rows[position]['timestamp'] > row['timestamp']:
+                position += 1
+            # Copy on write: readers may still hold the previous list
+            self._rows[device] = (rows[:position] + [row] + rows[position:])[:self.size]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'devices': len(self._rows),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,83 @@
+import threading
+from datetime import datetime
+
+from models import db, MealCounter
+
+
+class CounterService:
+    """Meal counter of one device, incremented in the caller's transaction."""
+
+    def __init__(self, device, cache_values=True):
+        self.device = device
+        self.cache_values = cache_values
+        self._lock = threading.Lock()
+        self._row_id = None
+        self._value = None
+        # Bumped on reset so increments committed before a reset cannot
+        # overwrite the cached zero when they are remembered afterwards
+        self._generation = 0
+        self._local = threading.local()
+
+    def ensure(self):
+        """Create the counter row if missing and return its id."""
+        if self._row_id is None:
+            counter = MealCounter.query.filter_by(device=self.device).first()
+            if not counter:
+                counter = MealCounter(count=0, device=self.device)
+                db.session.add(counter)
+                db.session.commit()
+            self._row_id = counter.id
+        return self._row_id
+
+    def value(self):
+        with self._lock:
+            if self._value is not None:
+                return self._value
+        row_id = self.ensure()
+        count = db.session.execute(
+            db.select(MealCounter.count).where(MealCounter.id == row_id)
+        ).scalar_one()
+        if not self.cache_values:
+            return count
+        with self._lock:
+            if self._value is None:
+                self._value = count
+            return self._value
+
+    def increment(self):
+        """Add one meal inside the current transaction and return the new count."""
+        row_id = self.ensure()
+        with self._lock:
+            self._local.generation = self._generation
+        stmt = db.update(MealCounter).where(MealCounter.id == row_id).values(count=MealCounter.count + 1)
+        if db.engine.dialect.update_returning:
+            return db.session.execute(stmt.returning(MealCounter.count)).scalar_one()
+        db.session.execute(stmt)
+        return db.session.execute(
+            db.select(MealCounter.count).where(MealCounter.id == row_id)
+        ).scalar_one()
+
+    def remember(self, count):
+        """Publish a committed ``increment`` result to the in-process cache."""
+        if not self.cache_values:
+            return
+        with self._lock:
+            if getattr(self._local, 'generation', None) != self._generation:
+                # A reset happened meanwhile; re-read the committed value next time
+                self._value = None
+                return
+            # Commits can finish out of order across threads; counts only grow
+            if self._value is None or count > self._value:
+                self._value = count
+
+    def reset(self):
+        """Set the counter to zero, record the reset time and commit."""
+        row_id = self.ensure()
+        db.session.execute(
+            db.update(MealCounter).where(MealCounter.id == row_id)
+            .values(count=0, last_reset=datetime.utcnow())
+        )
+        db.session.commit()
+        with self._lock:
+            self._generation += 1
+            self._value = 0 if self.cache_values else None
@@ -0,0 +1,78 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+def write_atomic(path, data):
+    """Write ``data`` to ``path`` through a temp file, so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class DiskBudget:
+    """Caps a cache directory at ``max_bytes``, deleting least recently used files first."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._files = None  # path -> size, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _index(self):
+        # Called with the lock held
+        if self._files is None:
+            found = []
+            for root, _, filenames in os.walk(self.directory):
+                for filename in filenames:
+                    if filename.endswith('.tmp'):
+                        continue
+                    path = os.path.join(root, filename)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((st.st_mtime, path, st.st_size))
+            found.sort()
+            self._files = OrderedDict((path, size) for _, path, size in found)
+            self._bytes = sum(self._files.values())
+        return self._files
+
+    def touch(self, path):
+        """Mark ``path`` as recently used if it is on disk, e.g. after a memory hit."""
+        with self._lock:
+            files = self._index()
+            if path in files:
+                files.move_to_end(path)
+
+    def used(self, path, size):
+        """Record that ``path`` was just read or written; evicts files past the cap."""
+        with self._lock:
+            files = self._index()
+            self._bytes += size - files.pop(path, 0)
+            files[path] = size
+            evicted = []
+            while self._bytes > self.max_bytes and len(files) > 1:
+                old_path, old_size = files.popitem(last=False)
+                self._bytes -= old_size
+                evicted.append(old_path)
+            self.evictions += len(evicted)
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            files = self._index()
+            return {
+                'disk_entries': len(files),
+                'disk_bytes': self._bytes,
+                'max_disk_bytes': self.max_bytes,
+                'evictions': self.evictions,
+            }
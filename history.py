@@ -0,0 +1,146 @@
+import base64
+import csv
+import io
+import json
+from datetime import date, datetime, time, timedelta, timezone
+
+from models import db, Faculty, ScanRecord
+from receipts import IST
+
+EXPORT_COLUMNS = ('scan_id', 'device', 'scanned_at', 'scanned_at_ist', 'faculty_id',
+                  'faculty_name', 'faculty_phone_number', 'faculty_department')
+
+
+class HistoryQueryError(ValueError):
+    """Raised for malformed filters or cursors; reported to clients as 400."""
+
+
+def parse_day(value):
+    """Parse a ``YYYY-MM-DD`` filter value, or return None if empty."""
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise HistoryQueryError(f'Invalid date {value!r}, expected YYYY-MM-DD')
+
+
+def filters_from(args):
+    """Build ``scans_query`` filters from request args or CLI options."""
+    return {
+        'device': args.get('device') or None,
+        'department': args.get('department') or None,
+        'start': parse_day(args.get('from')),
+        'end': parse_day(args.get('to')),
+    }
+
+
+def ist_day_start(day):
+    """Naive UTC datetime of midnight IST on ``day``, matching stored timestamps."""
+    return datetime.combine(day, time(), IST).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def scans_query(device=None, department=None, start=None, end=None):
+    """Select scans joined to faculty, newest first; ``start`` and ``end`` are inclusive IST days."""
+    stmt = (
+        db.select(
+            ScanRecord.id, ScanRecord.device, ScanRecord.scanned_at, ScanRecord.faculty_id,
+            Faculty.name, Faculty.phone_number, Faculty.department,
+        )
+        .join(Faculty, ScanRecord.faculty_id == Faculty.id)
+        .order_by(ScanRecord.scanned_at.desc(), ScanRecord.id.desc())
+    )
+    if device:
+        stmt = stmt.where(ScanRecord.device == device)
+    if department:
+        stmt = stmt.where(Faculty.department == department)
+    if start:
+        stmt = stmt.where(ScanRecord.scanned_at >= ist_day_start(start))
+    if end:
+        stmt = stmt.where(ScanRecord.scanned_at < ist_day_start(end + timedelta(days=1)))
+    return stmt
+
+
+def encode_cursor(scanned_at, scan_id):
+    raw = f'{scanned_at.isoformat()}|{scan_id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        scanned_at, scan_id = raw.split('|', 1)
+        return datetime.fromisoformat(scanned_at), scan_id
+    except (ValueError, UnicodeDecodeError):
+        raise HistoryQueryError('Invalid cursor')
+
+
+def _row_dict(row):
+    return {
+        'scan_id': row.id,
+        'device': row.device,
+        'faculty_id': row.faculty_id,
+        'faculty_name': row.name,
+        'faculty_phone_number': row.phone_number,
+        'faculty_department': row.department,
+        'scanned_at': row.scanned_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'timestamp': row.scanned_at.timestamp(),
+    }
+
+
+def page(limit, cursor=None, **filters):
+    """Return ``(scans, next_cursor)`` for one keyset page; ``next_cursor`` is None on the last."""
+    stmt = scans_query(**filters)
+    if cursor:
+        scanned_at, scan_id = decode_cursor(cursor)
+        stmt = stmt.where(db.or_(
+            ScanRecord.scanned_at < scanned_at,
+            db.and_(ScanRecord.scanned_at == scanned_at, ScanRecord.id < scan_id),
+        ))
+    # One extra row tells whether another page follows
+    rows = db.session.execute(stmt.limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].scanned_at, rows[-1].id)
+    return [_row_dict(row) for row in rows], next_cursor
+
+
+def iter_scans(batch_size=1000, **filters):
+    """Yield every matching scan as an export row, ``batch_size`` rows at a time."""
+    stmt = scans_query(**filters).execution_options(stream_results=True, yield_per=batch_size)
+    for row in db.session.execute(stmt):
+        yield (
+            row.id, row.device,
+            row.scanned_at.strftime('%Y-%m-%d %H:%M:%S'),
+            row.scanned_at.replace(tzinfo=timezone.utc).astimezone(IST).strftime('%Y-%m-%d %H:%M:%S'),
+            row.faculty_id, row.name, row.phone_number, row.department,
+        )
+
+
+def _with_header(rows):
+    yield EXPORT_COLUMNS
+    yield from rows
+
+
+def iter_csv(rows):
+    """Encode export rows as CSV text, one line per chunk, header first."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for values in _with_header(rows):
+        writer.writerow(values)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def iter_ndjson(rows):
+    """Encode export rows as newline-delimited JSON objects."""
+    for values in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, values))) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (iter_csv, 'text/csv'),
+    'ndjson': (iter_ndjson, 'application/x-ndjson'),
+}
@@ -0,0 +1,111 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from models import db
+
+log = logging.getLogger('auto_canteen.ingest')
+
+
+class ScanWriter:
+    """Group commit for scans: one writer thread, one transaction per batch."""
+
+    def __init__(self, app, stage, publish, interval=0.005, max_batch=64, timeout=30):
+        self.app = app
+        self.stage = stage
+        self.publish = publish
+        self.interval = interval
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {'scans': 0, 'batches': 0, 'largest_batch': 0, 'retried_batches': 0, 'cancelled': 0}
+
+    def _ensure_thread(self):
+        # Started on first use so importing the app does not spawn threads
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='scan-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, device, faculty, now):
+        """Queue a scan and wait for its committed result; cancelled if the wait times out."""
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((device, faculty, now, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            if future.cancel():
+                raise
+        # Already in a batch being written: its outcome is moments away
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._process(batch)
+            except Exception as e:
+                # Fail this batch's waiters rather than lose the only writer thread
+                log.exception('scan batch failed', extra={'fields': {'size': len(batch)}})
+                for item in batch:
+                    if not item[3].done():
+                        item[3].set_exception(e)
+
+    def _process(self, batch):
+        # Skip scans cancelled by a timed-out submit; the rest can no longer be cancelled
+        pending = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        with self._lock:
+            self._stats['cancelled'] += len(batch) - len(pending)
+        batch = pending
+        if not batch:
+            return
+        with self.app.app_context():
+            try:
+                self._write(batch)
+            except Exception:
+                db.session.rollback()
+                with self._lock:
+                    self._stats['retried_batches'] += 1
+                for item in batch:
+                    try:
+                        self._write([item])
+                    except Exception as e:
+                        db.session.rollback()
+                        item[3].set_exception(e)
+        with self._lock:
+            self._stats['scans'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['largest_batch'] = max(self._stats['largest_batch'], len(batch))
+
+    def _write(self, batch):
+        results = [self.stage(device, faculty, now) for device, faculty, now, _ in batch]
+        db.session.commit()
+        for (device, faculty, _, future), result in zip(batch, results):
+            try:
+                future.set_result(self.publish(device, faculty, result))
+            except Exception as e:
+                future.set_exception(e)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_batch'] = stats['scans'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
@@ -0,0 +1,91 @@
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger('auto_canteen')
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, event fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Resolve message and traceback on the calling thread, but keep the fields for the JSON formatter
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def handleError(self, record):
+        # Never raise or print from a request thread because logging failed
+        pass
+
+
+class Sampler(logging.Filter):
+    """Keep one in ``every`` records of each event logged with a ``sample`` key."""
+
+    def __init__(self, every=1):
+        super().__init__()
+        self.every = max(1, every)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'sample', None)
+        if key is None or self.every == 1 or record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            counter = self._counters.setdefault(key, itertools.count())
+            keep = next(counter) % self.every == 0
+        if keep:
+            record.fields = dict(getattr(record, 'fields', None) or {}, sampled_every=self.every)
+        return keep
+
+
+def setup_logging(level='INFO', log_file=None, max_bytes=10 * 1024 * 1024, backups=5, sample_every=1,
+                  max_queue=10000):
+    """Log ``auto_canteen`` as JSON to stdout and a rotating file from a listener thread."""
+    formatter = JSONFormatter()
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backups, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.Queue(maxsize=max_queue)
+    queue_handler = _QueueHandler(records)
+    queue_handler.addFilter(Sampler(sample_every))
+    logger.handlers[:] = [queue_handler]
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
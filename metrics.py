@@ -0,0 +1,183 @@
+import bisect
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, _labels(self.labelnames, key), value
+
+
+class Gauge:
+    """Gauge read at scrape time from ``collect()``, which returns ``{label values: value}``."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, collect, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        for key, value in sorted(self.collect().items()):
+            yield self.name, _labels(self.labelnames, key if isinstance(key, tuple) else (key,)), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, sum_)) for key, (counts, total, sum_) in self._series.items())
+        for key, (counts, total, sum_) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (f'{self.name}_bucket', _labels(self.labelnames + ('le',), key + (_number(bound),)),
+                       cumulative)
+            yield f'{self.name}_bucket', _labels(self.labelnames + ('le',), key + ('+Inf',)), total
+            yield f'{self.name}_count', _labels(self.labelnames, key), total
+            yield f'{self.name}_sum', _labels(self.labelnames, key), sum_
+
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class RequestMetrics:
+    """Per-route latency and SQL statement metrics for a Flask app."""
+
+    def __init__(self, registry):
+        self.requests = registry.histogram(
+            'canteen_request_duration_seconds', 'Time to handle a request, by route',
+            labelnames=('endpoint', 'method', 'status'))
+        self.sql_per_request = registry.histogram(
+            'canteen_sql_statements_per_request', 'SQL statements executed per request, by route',
+            labelnames=('endpoint',), buckets=COUNT_BUCKETS)
+        self.sql_statements = registry.counter(
+            'canteen_sql_statements_total', 'SQL statements executed, by route', labelnames=('endpoint',))
+        self.sql_seconds = registry.counter(
+            'canteen_sql_seconds_total', 'Time spent executing SQL statements, by route', labelnames=('endpoint',))
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._status)
+        app.teardown_request(self._finish)
+
+    def watch_engine(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor)
+
+    def _start(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_sql = 0
+        g.metrics_status = 500
+
+    def _status(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _finish(self, exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        endpoint = request.endpoint or 'unmatched'
+        self.requests.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method,
+                              status=g.pop('metrics_status', 500))
+        self.sql_per_request.observe(g.pop('metrics_sql', 0), endpoint=endpoint)
+
+    def _before_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def _after_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get('metrics_started')
+        elapsed = time.perf_counter() - stack.pop() if stack else 0.0
+        if has_request_context():
+            endpoint = request.endpoint or 'unmatched'
+            g.metrics_sql = g.get('metrics_sql', 0) + 1
+        else:
+            endpoint = 'background'
+        self.sql_statements.inc(endpoint=endpoint)
+        self.sql_seconds.inc(elapsed, endpoint=endpoint)
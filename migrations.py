@@ -0,0 +1,91 @@
+from sqlalchemy import MetaData, inspect, text
+
+from models import db, Faculty
+
+# The second counter used to live in its own copies of every table
+LEGACY_DEVICE = '2'
+LEGACY_DEVICE_TABLES = ('scan_record2', 'faculty2', 'meal_counter2')
+
+
+def _columns(inspector, table):
+    return {column['name'] for column in inspector.get_columns(table)}
+
+
+def _rebuild_faculty(conn):
+    """Add ``faculty.device`` and make phone numbers unique per device by copying the table."""
+    if conn.dialect.name != 'sqlite':
+        conn.execute(text("ALTER TABLE faculty ADD COLUMN device VARCHAR(20) NOT NULL DEFAULT '1'"))
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text('ALTER TABLE faculty DROP CONSTRAINT IF EXISTS faculty_phone_number_key'))
+        return
+
+    conn.execute(text('DROP TABLE IF EXISTS faculty_migrating'))
+    Faculty.__table__.to_metadata(MetaData(), name='faculty_migrating').create(conn)
+    conn.execute(text(
+        "INSERT INTO faculty_migrating (id, name, phone_number, department, registration_date, device) "
+        "SELECT id, name, phone_number, department, registration_date, '1' FROM faculty"
+    ))
+    conn.execute(text('DROP TABLE faculty'))
+    conn.execute(text('ALTER TABLE faculty_migrating RENAME TO faculty'))
+
+
+def upgrade_to_devices():
+    """Move the legacy Device 2 tables into the shared schema; safe to rerun, returns the steps done."""
+    steps = []
+    with db.engine.begin() as conn:
+        inspector = inspect(conn)
+        tables = set(inspector.get_table_names())
+
+        if 'faculty_migrating' in tables and 'faculty' not in tables:
+            # Interrupted between dropping the old table and renaming the new one
+            conn.execute(text('ALTER TABLE faculty_migrating RENAME TO faculty'))
+            tables.add('faculty')
+            steps.append('finished interrupted faculty rebuild')
+
+        if 'faculty' in tables and 'device' not in _columns(inspector, 'faculty'):
+            _rebuild_faculty(conn)
+            steps.append('added faculty.device')
+
+        if 'scan_record' in tables and 'device' not in _columns(inspector, 'scan_record'):
+            conn.execute(text("ALTER TABLE scan_record ADD COLUMN device VARCHAR(20) NOT NULL DEFAULT '1'"))
+            # Superseded by ix_scan_record_device_scanned_at
+            conn.execute(text('DROP INDEX IF EXISTS ix_scan_record_scanned_at'))
+            steps.append('added scan_record.device')
+
+        if 'meal_counter' in tables and 'device' not in _columns(inspector, 'meal_counter'):
+            # Only the first row was ever used; the device column is unique
+            conn.execute(text('DELETE FROM meal_counter WHERE id NOT IN (SELECT MIN(id) FROM meal_counter)'))
+            conn.execute(text("ALTER TABLE meal_counter ADD COLUMN device VARCHAR(20) NOT NULL DEFAULT '1'"))
+            steps.append('added meal_counter.device')
+
+        legacy = [table for table in LEGACY_DEVICE_TABLES if table in tables]
+        if not legacy:
+            return steps
+
+        db.metadata.create_all(conn)
+        params = {'device': LEGACY_DEVICE}
+        if 'faculty2' in legacy:
+            conn.execute(text(
+                "INSERT INTO faculty (id, name, phone_number, department, registration_date, device) "
+                "SELECT id, name, phone_number, department, registration_date, :device FROM faculty2 "
+                "WHERE id NOT IN (SELECT id FROM faculty)"
+            ), params)
+        if 'scan_record2' in legacy:
+            conn.execute(text(
+                "INSERT INTO scan_record (id, faculty_id, scanned_at, device) "
+                "SELECT id, faculty_id, scanned_at, :device FROM scan_record2 "
+                "WHERE id NOT IN (SELECT id FROM scan_record)"
+            ), params)
+        if 'meal_counter2' in legacy:
+            has_counter = conn.execute(
+                text('SELECT 1 FROM meal_counter WHERE device = :device'), params
+            ).first()
+            if not has_counter:
+                conn.execute(text(
+                    "INSERT INTO meal_counter (count, last_reset, device) "
+                    "SELECT count, last_reset, :device FROM meal_counter2 ORDER BY id LIMIT 1"
+                ), params)
+        for table in legacy:
+            conn.execute(text(f'DROP TABLE {table}'))
+        steps.append(f"moved {', '.join(legacy)} into device '{LEGACY_DEVICE}'")
+    return steps
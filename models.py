@@ -0,0 +1,98 @@
+import uuid
+from datetime import datetime
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+
+db = SQLAlchemy()
+
+# --- Database Models ---
+# Every row belongs to a serving counter ("device"). Device ids are short
+# strings such as '1' and '2'; see CANTEEN_DEVICES in app.py.
+class Faculty(db.Model):
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    name = db.Column(db.String(100), nullable=False)
+    phone_number = db.Column(db.String(10), nullable=False) 
+    department = db.Column(db.String(100), nullable=False)
+    registration_date = db.Column(db.DateTime, default=datetime.utcnow)
+    device = db.Column(db.String(20), nullable=False, default='1', server_default='1')
+    scan_records = db.relationship('ScanRecord', backref='faculty', lazy=True)
+    __table_args__ = (
+        # Each counter keeps its own registrations, so a phone number is unique per device
+        db.Index('uq_faculty_device_phone_number', 'device', 'phone_number', unique=True),
+    )
+
+class ScanRecord(db.Model):
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    faculty_id = db.Column(db.String(36), db.ForeignKey('faculty.id'), nullable=False)
+    scanned_at = db.Column(db.DateTime, default=datetime.utcnow)
+    device = db.Column(db.String(20), nullable=False, default='1', server_default='1')
+    __table_args__ = (
+        # Cooldown check: latest scan for one faculty member
+        db.Index('ix_scan_record_faculty_id_scanned_at', 'faculty_id', 'scanned_at'),
+        # Recent scans / latest scan listings per device
+        db.Index('ix_scan_record_device_scanned_at', 'device', 'scanned_at'),
+    )
+
+class MealCounter(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, default=0)
+    last_reset = db.Column(db.DateTime, default=datetime.utcnow)
+    device = db.Column(db.String(20), nullable=False, default='1', server_default='1')
+    __table_args__ = (
+        db.Index('uq_meal_counter_device', 'device', unique=True),
+    )
+
+# --- Reporting ---
+class DailyRollup(db.Model):
+    """Per-day (UTC), per-device totals kept up to date by the scan and register paths."""
+    day = db.Column(db.Date, primary_key=True)
+    device = db.Column(db.String(20), primary_key=True)
+    scans = db.Column(db.Integer, nullable=False, default=0)
+    unique_faculty = db.Column(db.Integer, nullable=False, default=0)
+    registrations = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MonthlySummary(db.Model):
+    """Meals of one faculty member at one device in a closed IST month."""
+    month = db.Column(db.Date, primary_key=True)  # first day of the month
+    device = db.Column(db.String(20), primary_key=True)
+    faculty_id = db.Column(db.String(36), primary_key=True)
+    department = db.Column(db.String(100), nullable=False)
+    meals = db.Column(db.Integer, nullable=False, default=0)
+    meal_days = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MonthClose(db.Model):
+    """A (month, device) whose ``MonthlySummary`` rows are complete, with its totals."""
+    month = db.Column(db.Date, primary_key=True)
+    device = db.Column(db.String(20), primary_key=True)
+    closed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    meals = db.Column(db.Integer, nullable=False, default=0)
+    faculty = db.Column(db.Integer, nullable=False, default=0)
+
+
+def ensure_schema():
+    """Create missing tables, then any indexes missing from existing tables."""
+    db.create_all()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+
+def configure_sqlite(engine, journal_mode='WAL', synchronous='NORMAL', busy_timeout_ms=5000):
+    """Apply journal, synchronous and busy-timeout pragmas to new SQLite connections."""
+    if synchronous.upper() not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+        raise ValueError(f'Unknown SQLite synchronous setting {synchronous!r}')
+    if journal_mode and journal_mode.upper() not in ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'):
+        raise ValueError(f'Unknown SQLite journal mode {journal_mode!r}')
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA busy_timeout = {int(busy_timeout_ms)}')
+        if journal_mode:
+            cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+        cursor.execute(f'PRAGMA synchronous = {synchronous}')
+        cursor.close()
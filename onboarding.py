@@ -0,0 +1,110 @@
+import csv
+import io
+import re
+import uuid
+from collections import namedtuple
+from datetime import datetime
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+import rollup
+from models import db, Faculty
+
+PHONE_NUMBER = re.compile(r'^\d{10}$')
+NAME_MAX_LENGTH = Faculty.__table__.c.name.type.length
+
+Reject = namedtuple('Reject', 'line reason row')
+ImportReport = namedtuple('ImportReport', 'imported duplicates rejects')
+
+
+class EnrollmentInvalid(Exception):
+    """Raised for enrollment links that are tampered with, expired or for another device."""
+
+
+class EnrollmentSigner:
+    """Signed per-faculty enrollment links for pre-registered staff."""
+
+    def __init__(self, secret_key, max_age=30 * 24 * 3600):
+        self.max_age = max_age
+        self._serializer = URLSafeTimedSerializer(secret_key, salt='faculty-enrollment')
+
+    def issue(self, device, faculty_id):
+        return self._serializer.dumps({'d': device, 'f': faculty_id})
+
+    def verify(self, token, device):
+        """Return the faculty id carried by ``token`` for ``device``."""
+        try:
+            payload = self._serializer.loads(token, max_age=self.max_age)
+        except SignatureExpired:
+            raise EnrollmentInvalid('enrollment link expired')
+        except BadSignature:
+            raise EnrollmentInvalid('bad signature')
+        if payload.get('d') != device:
+            raise EnrollmentInvalid('enrollment link is for another device')
+        return payload['f']
+
+
+def read_csv(text):
+    """Yield ``(line, row)`` from CSV text with a name/phone/department header."""
+    reader = csv.DictReader(io.StringIO(text))
+    for row in reader:
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        if 'phone_number' not in row and 'phone' in row:
+            row['phone_number'] = row.pop('phone')
+        yield reader.line_num, row
+
+
+def _validate(row):
+    name = row.get('name', '')
+    phone_number = row.get('phone_number', '')
+    department = row.get('department', '')
+    if not all([name, phone_number, department]):
+        return 'name, phone and department are required'
+    if not PHONE_NUMBER.match(phone_number):
+        return 'phone number must be exactly 10 digits'
+    if len(name) > NAME_MAX_LENGTH:
+        return f'name longer than {NAME_MAX_LENGTH} characters'
+    return None
+
+
+def import_faculty(rows, device, batch_size=500):
+    """Insert faculty from ``(line, row)`` pairs in one transaction; returns an :class:`ImportReport`."""
+    known = set(db.session.execute(
+        db.select(Faculty.phone_number).where(Faculty.device == device)
+    ).scalars())
+
+    imported, duplicates, rejects = [], [], []
+    batch = []
+
+    def flush():
+        if not batch:
+            return
+        registered_at = datetime.utcnow()
+        for values in batch:
+            values['registration_date'] = registered_at
+        db.session.execute(db.insert(Faculty), batch)
+        rollup.record_registration(device, registered_at, count=len(batch))
+        imported.extend((v['id'], v['name'], v['phone_number'], v['department']) for v in batch)
+        batch.clear()
+
+    for line, row in rows:
+        reason = _validate(row)
+        if reason:
+            rejects.append(Reject(line, reason, row))
+            continue
+        if row['phone_number'] in known:
+            duplicates.append(Reject(line, 'phone number already registered', row))
+            continue
+        known.add(row['phone_number'])
+        batch.append({
+            'id': str(uuid.uuid4()),
+            'name': row['name'],
+            'phone_number': row['phone_number'],
+            'department': row['department'],
+            'device': device,
+        })
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    db.session.commit()
+    return ImportReport(imported, duplicates, rejects)
@@ -0,0 +1,75 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from files import DiskBudget, write_atomic
+
+log = logging.getLogger('auto_canteen.qr')
+
+FORMATS = {
+    'png': 'image/png',
+    # Vector output skips rasterizing and compressing a bitmap, and prints sharply
+    'svg': 'image/svg+xml',
+}
+
+
+def cache_key(url, fmt):
+    return hashlib.sha256(f'{fmt}:{url}'.encode('utf-8')).hexdigest()
+
+
+def render(url, fmt='png'):
+    """Return the QR code for ``url`` as PNG or SVG bytes."""
+    import qrcode
+    import qrcode.image.svg
+
+    if fmt == 'svg':
+        image = qrcode.make(url, image_factory=qrcode.image.svg.SvgPathImage)
+    else:
+        image = qrcode.make(url)
+    buffer = io.BytesIO()
+    image.save(buffer)
+    return buffer.getvalue()
+
+
+class QRCache:
+    """In-memory LRU of rendered QR codes backed by a capped ``directory`` on disk."""
+
+    def __init__(self, directory, max_entries=128, max_disk_bytes=16 * 1024 * 1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._disk = DiskBudget(directory, max_disk_bytes)
+        self._lock = threading.Lock()
+
+    def _path(self, key, fmt):
+        return os.path.join(self.directory, key[:2], f'{key}.{fmt}')
+
+    def get(self, url, fmt='png'):
+        """Return ``(key, data)`` for ``url``, rendering it on a miss."""
+        key = cache_key(url, fmt)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return key, data
+        path = self._path(key, fmt)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            self._disk.used(path, len(data))
+        except OSError:
+            data = render(url, fmt)
+            try:
+                write_atomic(path, data)
+                self._disk.used(path, len(data))
+            except OSError as e:
+                log.warning('could not persist QR code', extra={'fields': {'key': key, 'error': str(e)}})
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+        return key, data
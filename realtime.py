@@ -0,0 +1,110 @@
+import pickle
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+import socketio
+
+
+class LocalPubSubManager(socketio.PubSubManager):
+    """In-process stand-in for the Redis message queue (``local://``)."""
+    name = 'local'
+
+    _subscribers = {}
+    _subscribers_lock = threading.Lock()
+
+    def __init__(self, url='local://', channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._inbox = queue.Queue()
+        if not write_only:
+            with self._subscribers_lock:
+                self._subscribers.setdefault(channel, []).append(self._inbox)
+
+    def _publish(self, data):
+        # Pickled like RedisManager does, so messages are copies, not shared objects
+        message = pickle.dumps(data)
+        with self._subscribers_lock:
+            inboxes = list(self._subscribers.get(self.channel, ()))
+        for inbox in inboxes:
+            inbox.put(message)
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
+
+
+class EventBatcher:
+    """Coalesces events per device into sequence-numbered batches, kept for replay."""
+
+    def __init__(self, socketio, room, window=0.15, replay_size=256, namespace='/'):
+        self.socketio = socketio
+        self.room = room
+        self.window = window
+        self.namespace = namespace
+        self.replay_size = replay_size
+        self.stream = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._seq = {}
+        self._history = {}
+        self.observer = None
+
+    def add(self, device, event, data):
+        with self._lock:
+            events = self._pending.get(device)
+            opened = events is None
+            if opened:
+                events = self._pending[device] = []
+            if event == 'counter_update':
+                events[:] = [e for e in events if e['event'] != 'counter_update']
+            events.append({'event': event, 'data': data})
+        if not self.window:
+            self.flush(device)
+        elif opened:
+            self.socketio.start_background_task(self._flush_later, device)
+
+    def _flush_later(self, device):
+        self.socketio.sleep(self.window)
+        self.flush(device)
+
+    def flush(self, device):
+        with self._lock:
+            events = self._pending.pop(device, None)
+            if not events:
+                return None
+            seq = self._seq[device] = self._seq.get(device, 0) + 1
+            # Emitted under the lock so batches leave in sequence order
+            batch = {'stream': self.stream, 'seq': seq, 'events': events}
+            history = self._history.get(device)
+            if history is None:
+                history = self._history[device] = deque(maxlen=self.replay_size)
+            history.append(batch)
+            started = time.perf_counter()
+            self.socketio.emit('scan_batch', batch, to=self.room(device), namespace=self.namespace)
+            elapsed = time.perf_counter() - started
+        if self.observer is not None:
+            self.observer(device, elapsed, len(events))
+        return batch
+
+    def position(self, device):
+        """Return ``(stream, seq)`` of the last batch sent for ``device``."""
+        with self._lock:
+            return self.stream, self._seq.get(device, 0)
+
+    def subscribe(self, device, sid, snapshot, stream=None, seq=None):
+        """Add ``sid`` to the device room and send it the batches it missed, or a snapshot."""
+        with self._lock:
+            self.socketio.server.enter_room(sid, self.room(device), namespace=self.namespace)
+            current = self._seq.get(device, 0)
+            history = self._history.get(device, ())
+            oldest = history[0]['seq'] if history else current + 1
+            if stream == self.stream and seq is not None and oldest - 1 <= seq <= current:
+                missed = [batch for batch in history if batch['seq'] > seq]
+                for batch in missed:
+                    self.socketio.emit('scan_batch', batch, to=sid, namespace=self.namespace)
+                return len(missed)
+            state = dict(snapshot(), stream=self.stream, seq=current)
+            self.socketio.emit('snapshot', state, to=sid, namespace=self.namespace)
+            return None
@@ -0,0 +1,44 @@
+from datetime import timezone
+from zoneinfo import ZoneInfo
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+IST = ZoneInfo('Asia/Kolkata')
+
+
+class ReceiptInvalid(Exception):
+    """Raised for receipts that are tampered with, expired or not the holder's."""
+
+
+def format_ist(scanned_at):
+    """Format a naive UTC timestamp from the database as IST for display."""
+    return scanned_at.replace(tzinfo=timezone.utc).astimezone(IST).strftime('%Y-%m-%d %I:%M %p')
+
+
+class ReceiptSigner:
+    """Signed receipts carrying what the scan-success page shows, bound to faculty and device."""
+
+    def __init__(self, secret_key, max_age=3600):
+        self.max_age = max_age
+        self._serializer = URLSafeTimedSerializer(secret_key, salt='scan-receipt')
+
+    def issue(self, device, faculty, scan_id, scanned_at):
+        return self._serializer.dumps({
+            'd': device,
+            'f': faculty.id,
+            'n': faculty.name,
+            's': scan_id,
+            't': format_ist(scanned_at),
+        })
+
+    def verify(self, token, device, faculty_id):
+        """Return ``(faculty_name, scanned_at_ist)`` for a valid receipt."""
+        try:
+            data = self._serializer.loads(token, max_age=self.max_age)
+        except SignatureExpired:
+            raise ReceiptInvalid('receipt expired')
+        except BadSignature:
+            raise ReceiptInvalid('bad receipt signature')
+        if data.get('d') != device or data.get('f') != faculty_id:
+            raise ReceiptInvalid('receipt belongs to another faculty member or device')
+        return data['n'], data['t']
@@ -0,0 +1,112 @@
+from datetime import date, datetime
+
+from models import db, DailyRollup, Faculty, ScanRecord
+
+COUNTERS = ('scans', 'unique_faculty', 'registrations')
+
+
+def _upsert(values):
+    """Add ``values`` to the (day, device) row, creating it if needed."""
+    table = DailyRollup.__table__
+    increments = {name: values.get(name, 0) for name in COUNTERS}
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).values(day=values['day'], device=values['device'], **increments)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['day', 'device'],
+            set_={name: table.c[name] + stmt.excluded[name] for name in COUNTERS},
+        )
+        db.session.execute(stmt)
+        return
+
+    updated = db.session.execute(
+        db.update(table)
+        .where(table.c.day == values['day'], table.c.device == values['device'])
+        .values({name: table.c[name] + increments[name] for name in COUNTERS})
+    ).rowcount
+    if not updated:
+        db.session.execute(db.insert(table).values(day=values['day'], device=values['device'], **increments))
+
+
+def record_scan(device, faculty_id, scanned_at):
+    """Count a scan in the current transaction; call after inserting it."""
+    day_start = datetime.combine(scanned_at.date(), datetime.min.time())
+    # Served by the (faculty_id, scanned_at) index
+    seen_today = db.session.execute(
+        db.select(db.literal(1)).where(
+            db.select(ScanRecord.id).where(
+                ScanRecord.faculty_id == faculty_id,
+                ScanRecord.scanned_at >= day_start,
+                ScanRecord.scanned_at < scanned_at,
+            ).exists()
+        )
+    ).scalar() is not None
+    _upsert({'day': scanned_at.date(), 'device': device, 'scans': 1,
+             'unique_faculty': 0 if seen_today else 1})
+
+
+def record_registration(device, registered_at, count=1):
+    """Count ``count`` new faculty registrations in the current transaction."""
+    _upsert({'day': registered_at.date(), 'device': device, 'registrations': count})
+
+
+def stats(device, today=None):
+    """Return the ``/api/stats`` payload for ``device`` from the rollup table."""
+    today = today or datetime.utcnow().date()
+    totals = db.session.execute(
+        db.select(
+            db.func.coalesce(db.func.sum(DailyRollup.registrations), 0),
+            db.func.coalesce(db.func.sum(DailyRollup.scans), 0),
+        ).where(DailyRollup.device == device)
+    ).one()
+    today_row = db.session.get(DailyRollup, (today, device))
+    return {
+        'total_faculty': totals[0],
+        'total_scans': totals[1],
+        'today_scans': today_row.scans if today_row else 0,
+        'today_unique_faculty': today_row.unique_faculty if today_row else 0,
+        'today_registrations': today_row.registrations if today_row else 0,
+    }
+
+
+def as_date(value):
+    # func.date() returns a string on SQLite and a date elsewhere
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def rebuild():
+    """Recompute every rollup row from scan and faculty history, in one transaction."""
+    rows = {}
+
+    def row(day, device):
+        return rows.setdefault((day, device), {'day': day, 'device': device,
+                                               'scans': 0, 'unique_faculty': 0, 'registrations': 0})
+
+    scan_day = db.func.date(ScanRecord.scanned_at)
+    for device, day, scans, unique_faculty in db.session.execute(
+        db.select(ScanRecord.device, scan_day, db.func.count(), db.func.count(db.distinct(ScanRecord.faculty_id)))
+        .group_by(ScanRecord.device, scan_day)
+    ):
+        if day is None:
+            continue
+        entry = row(as_date(day), device)
+        entry['scans'] = scans
+        entry['unique_faculty'] = unique_faculty
+
+    registration_day = db.func.date(Faculty.registration_date)
+    for device, day, registrations in db.session.execute(
+        db.select(Faculty.device, registration_day, db.func.count())
+        .group_by(Faculty.device, registration_day)
+    ):
+        if day is not None:
+            row(as_date(day), device)['registrations'] = registrations
+
+    db.session.execute(db.delete(DailyRollup))
+    if rows:
+        db.session.execute(db.insert(DailyRollup), list(rows.values()))
+    db.session.commit()
+    return len(rows)
@@ -0,0 +1,159 @@
+import bisect
+import threading
+from collections import namedtuple
+from datetime import datetime, time, timedelta, timezone
+
+from receipts import IST
+
+# One serving window per day, in IST wall-clock time
+MealSession = namedtuple('MealSession', 'name start end')
+# A session on one particular day, bounded by naive UTC datetimes like the
+# stored scan times; ``start`` also identifies the session in the served index
+SessionWindow = namedtuple('SessionWindow', 'name start end')
+
+DEFAULT_SESSIONS = 'breakfast=07:30-10:30,lunch=12:00-15:00,snacks=16:00-18:30'
+
+
+def _parse_time(value):
+    if value == '24:00':
+        return None  # midnight at the end of the day
+    return time.fromisoformat(value)
+
+
+def parse_sessions(spec):
+    """Parse ``name=HH:MM-HH:MM,...`` (IST) into sessions by start time; ValueError if invalid."""
+    sessions = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        try:
+            name, hours = item.split('=', 1)
+            start, end = hours.split('-', 1)
+            start, end = _parse_time(start.strip()), _parse_time(end.strip())
+        except ValueError:
+            raise ValueError(f'Invalid meal session {item!r}, expected name=HH:MM-HH:MM')
+        if start is None or (end is not None and end <= start):
+            raise ValueError(f'Meal session {item!r} must end after it starts, within one day')
+        sessions.append(MealSession(name.strip(), start, end))
+    if not sessions:
+        raise ValueError('At least one meal session is required')
+    sessions.sort(key=lambda s: s.start)
+    for before, after in zip(sessions, sessions[1:]):
+        if before.end is None or before.end > after.start:
+            raise ValueError(f'Meal sessions {before.name} and {after.name} overlap')
+    return sessions
+
+
+def format_time(at):
+    """Format a naive UTC datetime as an IST clock time, e.g. ``12:30 PM``."""
+    return at.replace(tzinfo=timezone.utc).astimezone(IST).strftime('%I:%M %p').lstrip('0')
+
+
+def _utc(day, at):
+    return datetime.combine(day, at, IST).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class SessionSchedule:
+    """Maps scan times to meal session windows."""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self._day = None  # (day start, next day start, windows, window starts)
+        self._lock = threading.Lock()
+
+    def _windows_for(self, now):
+        cached = self._day
+        if cached is not None and cached[0] <= now < cached[1]:
+            return cached
+        day = now.replace(tzinfo=timezone.utc).astimezone(IST).date()
+        next_day = day + timedelta(days=1)
+        windows = [SessionWindow(s.name, _utc(day, s.start), _utc(next_day, time()) if s.end is None
+                                 else _utc(day, s.end)) for s in self.sessions]
+        cached = (_utc(day, time()), _utc(next_day, time()), windows, [w.start for w in windows])
+        with self._lock:
+            self._day = cached
+        return cached
+
+    def current(self, now):
+        """The :data:`SessionWindow` containing ``now`` (naive UTC), or None."""
+        _, _, windows, starts = self._windows_for(now)
+        index = bisect.bisect_right(starts, now) - 1
+        if index >= 0 and now < windows[index].end:
+            return windows[index]
+        return None
+
+    def upcoming(self, now):
+        """The next :data:`SessionWindow` starting after ``now``, possibly tomorrow."""
+        day_end, windows, starts = self._windows_for(now)[1:]
+        index = bisect.bisect_right(starts, now)
+        if index < len(windows):
+            return windows[index]
+        return self._windows_for(day_end)[2][0]
+
+
+class ServedIndex:
+    """Faculty already served in the current session, per device, in memory."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.loaded = False
+        self._sessions = {}  # device -> (window start, {faculty_id: scanned_at})
+        self._lock = threading.Lock()
+        self.claims = 0
+        self.duplicates = 0
+        self.rollovers = 0
+
+    def _served(self, device, window):
+        current = self._sessions.get(device)
+        if current is None or current[0] < window.start:
+            if current is not None:
+                self.rollovers += 1
+            current = self._sessions[device] = (window.start, {})
+        elif current[0] > window.start:
+            # A scan timed just before a rollover another scan already made;
+            # its session is over, so it is not tracked any more
+            return {}
+        return current[1]
+
+    @property
+    def active(self):
+        """True once loaded; scans may then skip the database check."""
+        return self.enabled and self.loaded
+
+    def load(self, window, scans):
+        """Fill ``window`` from ``(device, faculty_id, scanned_at)`` rows and activate the index."""
+        sessions = {}
+        for device, faculty_id, scanned_at in scans:
+            sessions.setdefault(device, (window.start, {}))[1][faculty_id] = scanned_at
+        with self._lock:
+            self._sessions = sessions
+            self.loaded = True
+
+    def claim(self, device, window, faculty_id, now):
+        """Return None if ``faculty_id`` is newly served, else when they were served."""
+        with self._lock:
+            served = self._served(device, window)
+            previous = served.get(faculty_id)
+            if previous is not None:
+                self.duplicates += 1
+                return previous
+            served[faculty_id] = now
+            self.claims += 1
+            return None
+
+    def release(self, device, window, faculty_id):
+        """Undo a claim whose scan was not committed."""
+        with self._lock:
+            current = self._sessions.get(device)
+            if current is not None and current[0] == window.start:
+                current[1].pop(faculty_id, None)
+
+    def stats(self):
+        with self._lock:
+            served = {device: len(entries) for device, (_, entries) in self._sessions.items()}
+            return {
+                'enabled': self.enabled,
+                'active': self.active,
+                'served': served,
+                'claims': self.claims,
+                'duplicates': self.duplicates,
+                'rollovers': self.rollovers,
+            }
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger('auto_canteen.startup')
+
+
+class Startup:
+    """Initialization of an app, run in a background thread instead of on import."""
+
+    def __init__(self, app):
+        self.app = app
+        self._setup = []
+        self._required = []
+        self._warmup = []
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._started = None
+        self._ready_after = None
+        self._timings = {}
+        self._failed = []
+
+    def step(self, name, required=False):
+        """Decorator registering ``func()`` as a startup step called ``name``."""
+        def register(func):
+            (self._required if required else self._warmup).append((name, func))
+            return func
+        return register
+
+    def setup(self, func):
+        """Decorator registering ``func()`` to run once, in order, before the background thread starts."""
+        self._setup.append(func)
+        return func
+
+    def start(self):
+        """Run the setup hooks and start the background thread; later calls do nothing."""
+        with self._lock:
+            if self._thread is None:
+                # Popped as they run, so a failed hook is not followed by repeats of the ones before it
+                while self._setup:
+                    self._setup.pop(0)()
+                self._started = time.perf_counter()
+                self._thread = threading.Thread(target=self._run, name='startup', daemon=True)
+                self._thread.start()
+
+    def wait(self, timeout=None):
+        """Start if needed and wait for the required steps; False on timeout."""
+        if self._ready.is_set():
+            return True
+        self.start()
+        return self._ready.wait(timeout)
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def _time(self, name, func):
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                func()
+        finally:
+            with self._lock:
+                self._timings[name] = time.perf_counter() - started
+
+    def _run(self):
+        try:
+            # Each required step runs even if an earlier one failed
+            for name, func in self._required:
+                try:
+                    self._time(name, func)
+                except Exception:
+                    log.exception('startup step failed', extra={'fields': {'step': name}})
+                    with self._lock:
+                        self._failed.append(name)
+        finally:
+            self._ready_after = time.perf_counter() - self._started
+            self._ready.set()
+        log.info('ready', extra={'fields': {'seconds': round(self._ready_after, 3)}})
+
+        for name, func in self._warmup:
+            try:
+                self._time(name, func)
+            except Exception:
+                log.warning('warm-up step failed', exc_info=True, extra={'fields': {'step': name}})
+                with self._lock:
+                    self._failed.append(name)
+        log.info('warm-up finished', extra={'fields': {
+            'seconds': round(time.perf_counter() - self._started, 3)}})
+
+    def stats(self):
+        with self._lock:
+            timings = dict(self._timings)
+            failed = list(self._failed)
+        return {
+            'ready': self.ready,
+            'ready_after_seconds': self._ready_after,
+            'steps': timings,
+            'failed': failed,
+        }
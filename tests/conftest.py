@@ -0,0 +1,53 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py reads its settings on import; keep the database, caches and log in a scratch directory
+SCRATCH = tempfile.mkdtemp(prefix='auto_canteen_tests_')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(SCRATCH, 'canteen.db')}",
+    'LOG_FILE': os.path.join(SCRATCH, 'auto_canteen.log'),
+    'ASSET_DIR': os.path.join(SCRATCH, 'assets'),
+    'TTS_CACHE_DIR': os.path.join(SCRATCH, 'tts_cache'),
+    'QR_CACHE_DIR': os.path.join(SCRATCH, 'qr_cache'),
+    'ADMIN_TOKEN': 'test-admin-token',
+})
+os.environ.pop('SOCKETIO_MESSAGE_QUEUE', None)
+
+
+@pytest.fixture
+def client():
+    import app as canteen
+    canteen.startup.wait()
+    client = canteen.app.test_client()
+    # Plain http requests are redirected to https
+    client.environ_base['HTTP_X_FORWARDED_PROTO'] = 'https'
+    return client
+
+
+@pytest.fixture
+def canteen(client):
+    import app as canteen
+    return canteen
+
+
+@pytest.fixture
+def faculty(canteen, monkeypatch):
+    """A faculty member on device 1, with one meal session lasting all day."""
+    from models import Faculty, db
+    from sessions import SessionSchedule, parse_sessions
+    monkeypatch.setattr(canteen, 'meal_schedule', SessionSchedule(parse_sessions('day=00:00-24:00')))
+    member_id = str(uuid.uuid4())
+    with canteen.app.app_context():
+        member = Faculty(id=member_id, name='Test Faculty', phone_number=str(uuid.UUID(member_id).int)[:10],
+                         department='Testing', device='1')
+        db.session.add(member)
+        db.session.commit()
+        db.session.refresh(member)
+        db.session.expunge(member)
+    return member
@@ -0,0 +1,34 @@
+import pytest
+
+ADMIN_ENDPOINTS = [
+    ('GET', '/api/scans'),
+    ('GET', '/api/scans/export'),
+    ('GET', '/api/analytics/daily'),
+    ('GET', '/api/analytics/monthly'),
+    ('POST', '/api/faculty/import'),
+]
+
+
+@pytest.mark.parametrize('method,path', ADMIN_ENDPOINTS)
+def test_missing_token_is_401(client, method, path):
+    response = client.open(path, method=method)
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize('method,path', ADMIN_ENDPOINTS)
+def test_wrong_token_is_403(client, method, path):
+    response = client.open(path, method=method, headers={'X-Admin-Token': 'not-the-token'})
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize('method,path', [e for e in ADMIN_ENDPOINTS if e[0] == 'GET'])
+def test_admin_token_is_accepted(client, method, path):
+    response = client.open(path, method=method, headers={'X-Admin-Token': 'test-admin-token'})
+    assert response.status_code == 200
+
+
+def test_unset_admin_token_disables_admin_apis(client, monkeypatch):
+    import app as canteen
+    monkeypatch.setattr(canteen, 'ADMIN_TOKEN', None)
+    response = client.get('/api/scans', headers={'X-Admin-Token': ''})
+    assert response.status_code == 403
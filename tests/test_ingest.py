@@ -0,0 +1,65 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from ingest import ScanWriter
+from models import ScanRecord, db
+from sessions import ServedIndex
+
+
+def scan_concurrently(canteen, faculty, scans):
+    barrier = threading.Barrier(scans)
+    results = []
+
+    def scan():
+        with canteen.app.app_context():
+            barrier.wait()
+            results.append(canteen.record_scan('1', faculty))
+
+    threads = [threading.Thread(target=scan) for _ in range(scans)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+@pytest.mark.parametrize('indexed', [True, False])
+def test_group_commit_records_concurrent_duplicates_once(canteen, faculty, monkeypatch, indexed):
+    monkeypatch.setattr(canteen, 'scan_writer', ScanWriter(canteen.app, canteen.stage_scan, canteen.publish_scan,
+                                                           interval=0.05))
+    served_index = ServedIndex(enabled=indexed)
+    served_index.load(canteen.meal_schedule.current(datetime.utcnow()), [])
+    monkeypatch.setattr(canteen, 'served_index', served_index)
+
+    results = scan_concurrently(canteen, faculty, 8)
+
+    assert [result.blocked for result in results].count(False) == 1
+    with canteen.app.app_context():
+        stored = db.session.execute(
+            db.select(db.func.count()).select_from(ScanRecord).where(ScanRecord.faculty_id == faculty.id)
+        ).scalar()
+    assert stored == 1
+
+
+def test_writer_survives_a_failed_batch(canteen):
+    writer = ScanWriter(canteen.app, lambda device, faculty, now: now, lambda device, faculty, result: result)
+    process = writer._process
+
+    def fail(batch):
+        writer._process = process
+        raise RuntimeError('boom')
+
+    writer._process = fail
+    with pytest.raises(RuntimeError):
+        writer.submit('1', None, 'first')
+    assert writer.submit('1', None, 'second') == 'second'
+
+
+def test_writer_restarts_a_dead_thread(canteen):
+    writer = ScanWriter(canteen.app, lambda device, faculty, now: now, lambda device, faculty, result: result)
+    writer._thread = threading.Thread(target=lambda: None)
+    writer._thread.start()
+    writer._thread.join()
+    assert writer.submit('1', None, 'scan') == 'scan'
@@ -0,0 +1,43 @@
+import threading
+import uuid
+
+import socketio
+
+from realtime import LocalPubSubManager
+
+
+def make_server(channel):
+    return socketio.Server(client_manager=LocalPubSubManager(channel=channel), async_mode='threading')
+
+
+def test_emit_reaches_clients_of_another_server_on_the_channel():
+    channel = f'test-{uuid.uuid4().hex}'
+    sender, receiver = make_server(channel), make_server(channel)
+    sender.manager.initialize()
+    receiver.manager.initialize()
+
+    # A display connected to the receiving "worker" and joined to device 1's room
+    sid = receiver.manager.connect('eio-display', '/')
+    receiver.manager.enter_room(sid, '/', 'device:1')
+    received = []
+    delivered = threading.Event()
+
+    def send_packet(eio_sid, packet):
+        received.append((eio_sid, packet))
+        delivered.set()
+
+    receiver._send_eio_packet = send_packet
+
+    sender.emit('scan_batch', {'seq': 1}, room='device:1')
+
+    assert delivered.wait(2)
+    eio_sid, packet = received[0]
+    assert eio_sid == 'eio-display'
+    assert packet.data == '2["scan_batch",{"seq":1}]'
+
+
+def test_write_only_managers_do_not_subscribe():
+    channel = f'test-{uuid.uuid4().hex}'
+    LocalPubSubManager(channel=channel, write_only=True)
+    listener = LocalPubSubManager(channel=channel)
+    assert LocalPubSubManager._subscribers[channel] == [listener._inbox]
@@ -0,0 +1,131 @@
+from datetime import datetime
+
+import pytest
+
+from models import ScanRecord, db
+from sessions import DEFAULT_SESSIONS, ServedIndex, SessionSchedule, SessionWindow, parse_sessions
+
+# Times are naive UTC; IST is UTC+5:30, so lunch (12:00-15:00 IST) is 06:30-09:30 UTC
+schedule = SessionSchedule(parse_sessions(DEFAULT_SESSIONS))
+LUNCH = SessionWindow('lunch', datetime(2026, 1, 15, 6, 30), datetime(2026, 1, 15, 9, 30))
+SNACKS = SessionWindow('snacks', datetime(2026, 1, 15, 10, 30), datetime(2026, 1, 15, 13, 0))
+
+
+def test_current_session():
+    assert schedule.current(datetime(2026, 1, 15, 6, 30)) == LUNCH
+    assert schedule.current(datetime(2026, 1, 15, 9, 29)) == LUNCH
+    assert schedule.current(datetime(2026, 1, 15, 9, 30)) is None
+    assert schedule.current(datetime(2026, 1, 15, 1, 0)) is None
+
+
+def test_upcoming_session():
+    assert schedule.upcoming(datetime(2026, 1, 15, 9, 30)) == SNACKS
+    # After snacks the next session is tomorrow's breakfast, 07:30 IST
+    assert schedule.upcoming(datetime(2026, 1, 15, 14, 0)) == SessionWindow(
+        'breakfast', datetime(2026, 1, 16, 2, 0), datetime(2026, 1, 16, 5, 0))
+
+
+def test_session_ending_at_midnight():
+    late = SessionSchedule(parse_sessions('dinner=19:00-24:00'))
+    # 23:59 IST on the 15th is 18:29 UTC; the window ends at midnight IST
+    assert late.current(datetime(2026, 1, 15, 18, 29)).end == datetime(2026, 1, 15, 18, 30)
+
+
+@pytest.mark.parametrize('spec', ['', 'lunch=15:00-12:00', 'lunch=12:00', 'a=07:00-09:00,b=08:00-10:00'])
+def test_invalid_sessions(spec):
+    with pytest.raises(ValueError):
+        parse_sessions(spec)
+
+
+def test_claim_and_release():
+    index = ServedIndex()
+    index.load(LUNCH, [])
+    now = datetime(2026, 1, 15, 7, 0)
+    assert index.claim('1', LUNCH, 'f1', now) is None
+    assert index.claim('1', LUNCH, 'f1', datetime(2026, 1, 15, 7, 5)) == now
+    assert index.claim('2', LUNCH, 'f1', now) is None
+    index.release('1', LUNCH, 'f1')
+    assert index.claim('1', LUNCH, 'f1', now) is None
+    assert (index.claims, index.duplicates) == (3, 1)
+
+
+def test_rollover_at_session_boundary():
+    index = ServedIndex()
+    index.load(LUNCH, [('1', 'f1', datetime(2026, 1, 15, 7, 0))])
+    snack_time = SNACKS.start
+    assert index.claim('1', schedule.current(snack_time), 'f1', snack_time) is None
+    assert index.rollovers == 1
+    # A lunch scan that lost the race to the rollover is not tracked any more
+    assert index.claim('1', LUNCH, 'f2', datetime(2026, 1, 15, 9, 29)) is None
+    assert index.stats()['served'] == {'1': 1}
+
+
+def test_index_is_inactive_until_loaded():
+    index = ServedIndex()
+    assert not index.active
+    index.load(None, [])
+    assert index.active
+    assert not ServedIndex(enabled=False).active
+
+
+def count_scans(canteen, faculty):
+    with canteen.app.app_context():
+        return db.session.execute(
+            db.select(db.func.count()).select_from(ScanRecord).where(ScanRecord.faculty_id == faculty.id)
+        ).scalar()
+
+
+@pytest.fixture
+def served_index(canteen, monkeypatch):
+    index = ServedIndex()
+    index.load(canteen.meal_schedule.current(datetime.utcnow()), [])
+    monkeypatch.setattr(canteen, 'served_index', index)
+    return index
+
+
+def test_record_scan_claims(canteen, faculty, served_index):
+    with canteen.app.app_context():
+        first = canteen.record_scan('1', faculty)
+        second = canteen.record_scan('1', faculty)
+    assert not first.blocked
+    assert second.blocked and second.scanned_at == first.scanned_at
+    assert served_index.duplicates == 1
+    assert count_scans(canteen, faculty) == 1
+
+
+def test_failed_insert_releases_claim(canteen, faculty, served_index, monkeypatch):
+    stage_scan = canteen.stage_scan
+
+    def fail(device, faculty, now):
+        monkeypatch.setattr(canteen, 'stage_scan', stage_scan)
+        raise RuntimeError('insert failed')
+
+    monkeypatch.setattr(canteen, 'stage_scan', fail)
+    with canteen.app.app_context():
+        with pytest.raises(RuntimeError):
+            canteen.record_scan('1', faculty)
+        assert not canteen.record_scan('1', faculty).blocked
+    assert count_scans(canteen, faculty) == 1
+
+
+def test_database_check_before_load(canteen, faculty, monkeypatch):
+    index = ServedIndex()
+    monkeypatch.setattr(canteen, 'served_index', index)
+    with canteen.app.app_context():
+        assert not canteen.record_scan('1', faculty).blocked
+        assert canteen.record_scan('1', faculty).blocked
+    assert index.claims == 0
+    assert count_scans(canteen, faculty) == 1
+
+
+def test_restart_reloads_served_faculty(canteen, faculty, served_index, monkeypatch):
+    with canteen.app.app_context():
+        first = canteen.record_scan('1', faculty)
+    restarted = ServedIndex()
+    monkeypatch.setattr(canteen, 'served_index', restarted)
+    with canteen.app.app_context():
+        canteen.load_served_index()
+        second = canteen.record_scan('1', faculty)
+    assert restarted.active
+    assert second.blocked and second.scanned_at == first.scanned_at
+    assert count_scans(canteen, faculty) == 1
@@ -0,0 +1,356 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from files import DiskBudget, write_atomic
+
+log = logging.getLogger('auto_canteen.tts')
+
+# Voice settings used for every /api/speak request. They are part of the cache
+# key, so changing any of them naturally invalidates previously cached audio.
+# -a: amplitude (0-200), -s: speed (wpm)
+VOICE_PARAMS = {'engine': 'espeak', 'amplitude': 200, 'speed': 150}
+
+
+class TTSUnavailable(Exception):
+    """Raised when neither espeak nor festival could produce audio."""
+
+
+class TTSBusy(Exception):
+    """Raised when the synthesis queue is full; ``retry_after`` is in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'TTS is busy, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+def cache_key(text, params=None):
+    """Content address for a phrase: sha256 over the text and voice parameters."""
+    payload = dict(params or VOICE_PARAMS, text=text)
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _engines(text):
+    """Synthesizer commands in preference order, with the bytes to feed on stdin."""
+    # espeak is the most common engine on Raspberry Pi; --stdout writes the WAV
+    # to the pipe so nothing touches the SD card
+    yield 'espeak', ['espeak', '--stdout',
+                     '-a', str(VOICE_PARAMS['amplitude']),
+                     '-s', str(VOICE_PARAMS['speed']), text], None
+    # festival's text2wave reads plain text from stdin and writes WAV to stdout
+    yield 'festival', ['text2wave'], text.encode('utf-8')
+
+
+def iter_synthesis(text, chunk_size=4096, timeout=15, on_engine=None):
+    """Yield WAV bytes from the synthesizer's stdout as they are produced."""
+    for engine, cmd, stdin_data in _engines(text):
+        log.debug('running synthesizer', extra={'sample': 'tts_run', 'fields': {'engine': engine}})
+        try:
+            proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE if stdin_data is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError as e:
+            log.warning('synthesizer could not start', extra={'fields': {'engine': engine, 'error': str(e)}})
+            continue
+
+        # A stuck synthesizer would block read1() forever, so kill it on a timer
+        watchdog = threading.Timer(timeout, proc.kill)
+        watchdog.start()
+        produced = 0
+        try:
+            if stdin_data is not None:
+                proc.stdin.write(stdin_data)
+                proc.stdin.close()
+            while True:
+                chunk = proc.stdout.read1(chunk_size)
+                if not chunk:
+                    break
+                produced += len(chunk)
+                yield chunk
+            returncode = proc.wait()
+        finally:
+            watchdog.cancel()
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+
+        if returncode == 0 and produced:
+            log.info('speech synthesized', extra={'sample': 'tts_run', 'fields': {'engine': engine, 'bytes': produced}})
+            if on_engine is not None:
+                on_engine(engine)
+            return
+        if produced:
+            raise TTSUnavailable(f'{engine} exited with status {returncode} mid-stream')
+        log.warning('synthesizer produced no audio', extra={'fields': {'engine': engine, 'status': returncode}})
+
+    raise TTSUnavailable('espeak and festival are not available')
+
+
+def finalize_wav(data):
+    """Patch the RIFF and data chunk sizes of a WAV written to a pipe."""
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        return data
+    data = bytearray(data)
+    data[4:8] = (len(data) - 8).to_bytes(4, 'little')
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = bytes(data[pos:pos + 4])
+        if chunk_id == b'data':
+            data[pos + 4:pos + 8] = (len(data) - pos - 8).to_bytes(4, 'little')
+            break
+        size = int.from_bytes(data[pos + 4:pos + 8], 'little')
+        pos += 8 + size + (size & 1)
+    return bytes(data)
+
+
+class TTSCache:
+    """In-memory LRU of synthesized speech backed by a capped directory on disk."""
+
+    def __init__(self, directory, max_entries=256, max_disk_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._disk = DiskBudget(directory, max_disk_bytes)
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.wav')
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+        if data is not None:
+            self._disk.touch(self._path(key))
+            return data
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        self._disk.used(self._path(key), len(data))
+        self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        self._remember(key, data)
+        path = self._path(key)
+        try:
+            write_atomic(path, data)
+        except OSError as e:
+            log.warning('could not persist TTS cache entry', extra={'fields': {'key': key, 'error': str(e)}})
+            return
+        self._disk.used(path, len(data))
+
+    def _remember(self, key, data):
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            memory_entries = len(self._memory)
+        return dict(self._disk.stats(), memory_entries=memory_entries)
+
+
+class _Flight:
+    """A synthesis job shared by every request asking for the same phrase."""
+
+    def __init__(self, text):
+        self.text = text
+        self.enqueued_at = time.monotonic()
+        self.chunks = []
+        self.finished = False
+        self.audio = None
+        self.error = None
+        self.cacheable = False
+        self._cond = threading.Condition()
+
+    def feed(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, audio=None, error=None, cacheable=False):
+        with self._cond:
+            self.audio = audio
+            self.error = error
+            self.cacheable = cacheable
+            self.finished = True
+            self._cond.notify_all()
+
+    def wait(self, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.finished, timeout)
+
+    def iter_chunks(self, timeout):
+        sent = 0
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: sent < len(self.chunks) or self.finished, timeout):
+                    raise TimeoutError('TTS synthesis stalled')
+                pending = self.chunks[sent:]
+                finished = self.finished
+            for chunk in pending:
+                yield chunk
+            sent += len(pending)
+            if finished and sent == len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class TTSExecutor:
+    """Fixed pool of synthesis workers fed by a bounded queue, one job per phrase."""
+
+    def __init__(self, cache, workers=2, max_queue=16, wait_timeout=35):
+        self.cache = cache
+        self.workers = workers
+        self.wait_timeout = wait_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self.observer = None
+        self._stats = {
+            'requests': 0, 'cache_hits': 0, 'deduplicated': 0, 'rejected': 0,
+            'synthesized': 0, 'failed': 0,
+            'wait_seconds_total': 0.0, 'wait_seconds_max': 0.0,
+            'synthesis_seconds_total': 0.0,
+        }
+
+    def _ensure_workers(self):
+        # Started lazily so importing the app does not spawn threads
+        if len(self._threads) < self.workers:
+            for n in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._work, name=f'tts-worker-{n}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _retry_after(self):
+        synthesized = self._stats['synthesized'] or 1
+        average = self._stats['synthesis_seconds_total'] / synthesized or 1.0
+        return max(1, math.ceil(average * (self._queue.qsize() + 1) / self.workers))
+
+    def _submit(self, key, text):
+        with self._lock:
+            self._ensure_workers()
+            flight = self._inflight.get(key)
+            if flight is not None:
+                self._stats['deduplicated'] += 1
+                return flight
+            flight = _Flight(text)
+            try:
+                self._queue.put_nowait((key, flight))
+            except queue.Full:
+                self._stats['rejected'] += 1
+                raise TTSBusy(self._retry_after())
+            self._inflight[key] = flight
+            return flight
+
+    def speak(self, text):
+        """Return ``(key, audio_bytes, cacheable)``; fallback engine audio is not cacheable."""
+        key = cache_key(text)
+        with self._lock:
+            self._stats['requests'] += 1
+        audio = self.cache.get(key)
+        if audio is not None:
+            with self._lock:
+                self._stats['cache_hits'] += 1
+            return key, audio, True
+
+        flight = self._submit(key, text)
+        if not flight.wait(self.wait_timeout):
+            raise TTSBusy(self._retry_after())
+        if flight.error is not None:
+            raise flight.error
+        return key, flight.audio, flight.cacheable
+
+    def stream(self, text):
+        """Return ``(key, chunks, complete)``; ``chunks`` keeps yielding while synthesis runs."""
+        key = cache_key(text)
+        with self._lock:
+            self._stats['requests'] += 1
+        audio = self.cache.get(key)
+        if audio is not None:
+            with self._lock:
+                self._stats['cache_hits'] += 1
+            return key, [audio], True
+        flight = self._submit(key, text)
+        return key, flight.iter_chunks(self.wait_timeout), False
+
+    def warm(self, text):
+        """Queue ``text`` for synthesis without waiting for the result."""
+        key = cache_key(text)
+        if self.cache.get(key) is not None:
+            return
+        try:
+            self._submit(key, text)
+        except TTSBusy:
+            # Pre-warming is best effort; the first announcement will synthesize it
+            pass
+
+    def _work(self):
+        while True:
+            key, flight = self._queue.get()
+            waited = time.monotonic() - flight.enqueued_at
+            started = time.monotonic()
+            audio = error = None
+            cacheable = True
+            engines = []
+            try:
+                audio = self.cache.get(key)
+                if audio is None:
+                    for chunk in iter_synthesis(flight.text, on_engine=engines.append):
+                        flight.feed(chunk)
+                    audio = finalize_wav(b''.join(flight.chunks))
+                    # The key names the configured engine; fallback audio is only served once
+                    cacheable = engines == [VOICE_PARAMS['engine']]
+                    if cacheable:
+                        self.cache.put(key, audio)
+                else:
+                    flight.feed(audio)
+            except Exception as e:
+                error = e
+            finally:
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    self._inflight.pop(key, None)
+                    self._stats['wait_seconds_total'] += waited
+                    self._stats['wait_seconds_max'] = max(self._stats['wait_seconds_max'], waited)
+                    if error is None:
+                        self._stats['synthesized'] += 1
+                        self._stats['synthesis_seconds_total'] += elapsed
+                        for engine in engines:
+                            self._stats[f'synthesized_{engine}'] = self._stats.get(f'synthesized_{engine}', 0) + 1
+                    else:
+                        self._stats['failed'] += 1
+                if self.observer is not None:
+                    self.observer(elapsed, engines[0] if engines else None, error)
+                flight.finish(audio, error, cacheable)
+                self._queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queue_depth'] = self._queue.qsize()
+            stats['queue_capacity'] = self._queue.maxsize
+            stats['in_flight'] = len(self._inflight)
+        stats['workers'] = self.workers
+        dequeued = stats['synthesized'] + stats['failed']
+        stats['wait_seconds_avg'] = stats['wait_seconds_total'] / dequeued if dequeued else 0.0
+        return stats